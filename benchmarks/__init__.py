@@ -0,0 +1,5 @@
+""" Shift2Me benchmarks
+
+Synthetic titration generator, and benchmark harness timing core paths across data sizes.
+See benchmarks.synthetic and benchmarks.run modules.
+"""
@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+"""
+Shift2Me benchmark harness.
+Times core paths on synthetic titrations (see benchmarks.synthetic), across residues and steps counts :
+parsing, ingestion, intensities, cutoff filtering, protocole, job save/load and figures creation.
+Results are written as JSON, so that revisions may be compared with --compare.
+
+Run from repository root, as `python -m benchmarks.run`.
+
+Usage:
+    run [options]
+    run --compare <before.json> <after.json> [--threshold=<ratio>]
+    run -h
+
+Options:
+  -r <residues>, --residues=<residues>     Comma separated residues counts [default: 100,1000,10000]
+  -s <steps>, --steps=<steps>              Comma separated steps counts [default: 10,50]
+  -n <repeat>, --repeat=<repeat>           Timings of each case [default: 3]
+  -c <cases>, --cases=<cases>              Comma separated cases to run, all by default
+  -o <output>, --output=<output>           JSON results file [default: benchmarks.json]
+  --plot-max=<residues>                    Skip figure cases above this residues count [default: 1000]
+  --compare                                Compare two results files, flagging slower cases
+  --threshold=<ratio>                      Time ratio above which a case is flagged as slower [default: 1.2]
+  -h --help                                Print help and usage
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from docopt import docopt
+from tabulate import tabulate
+
+from benchmarks import synthetic
+from classes.Titration import Titration, TitrationCLI
+from classes.plots import Hist, MultiHist, ShiftMap, TitrationCurve
+
+FORMAT_VERSION = 1
+
+
+class Context(object):
+    """
+    Class Context.
+    Synthetic titration of a given size, written to a temporary directory,
+    and loaded once for cases needing a titration.
+    Parse cache lives in the temporary directory, so that cold loads are not affected by user cache.
+    """
+
+    def __init__(self, residues, steps):
+        self.residues = residues
+        self.steps = steps
+        self.directory = tempfile.mkdtemp(prefix='shift2me-bench-')
+        self.seriesDir = os.path.join(self.directory, 'series')
+        self.cacheDir = os.path.join(self.directory, 'cache')
+        self.files = synthetic.generate(self.seriesDir, residues=residues, steps=steps)
+        os.environ['XDG_CACHE_HOME'] = self.cacheDir
+        self.titration = self.load()
+        self.titration.set_cutoff(0.1)
+
+    def load(self, **kwargs):
+        "Loads titration from series directory, or job file"
+        with contextlib.redirect_stderr(io.StringIO()):
+            return TitrationCLI(self.seriesDir, **kwargs)
+
+    def clear_cache(self):
+        shutil.rmtree(self.cacheDir, ignore_errors=True)
+
+    def close(self):
+        plt.close('all')
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+## -----------------------------------------------------
+##         Cases
+## -----------------------------------------------------
+# each case gets a context, and returns a function to time, which is called once per timing
+
+def case_parse(context):
+    "Parses last step file, without parse cache"
+    titration = Titration()
+    def run():
+        with open(context.files[-1]) as stream:
+            titration.parse_titration_file(stream)
+    return run
+
+def case_ingest(context):
+    "Adds all steps from parsed content, through Titration.add_step"
+    parsed = []
+    parser = Titration()
+    for path in context.files:
+        with open(path) as stream:
+            future = Future()
+            future.set_result(parser.parse_titration_file(stream))
+            parsed.append((path, future))
+    def run():
+        titration = Titration()
+        with contextlib.redirect_stderr(io.StringIO()):
+            for path, future in parsed:
+                titration.add_step(path, None, parsed=future)
+    return run
+
+def case_load_cold(context):
+    "Loads titration directory with empty parse cache"
+    def run():
+        context.clear_cache()
+        context.load()
+    return run
+
+def case_load_warm(context):
+    "Loads titration directory with filled parse cache"
+    context.load()
+    return context.load
+
+def case_intensities(context):
+    "Calculates intensities of all residues at all steps"
+    titration = context.titration
+    def run():
+        titration.invalidate_intensities()
+        titration.intensities
+    return run
+
+def case_filtered(context):
+    "Filters residues by cutoff, without cached intensities"
+    titration = context.titration
+    def run():
+        titration.invalidate_intensities()
+        titration.filtered
+    return run
+
+def case_filtered_warm(context):
+    "Filters residues by 100 cutoff values, as when moving cutoff slider"
+    titration = context.titration
+    titration.filtered
+    maxIntensity = float(np.nanmax(titration.intensities))
+    cutoffs = np.linspace(0, maxIntensity, 100)
+    def run():
+        for cutoff in cutoffs:
+            titration.cutoff = cutoff
+            titration.filtered
+        titration.cutoff = 0.1
+    return run
+
+def case_protocole(context):
+    "Builds protocole table"
+    return context.titration.make_protocole
+
+def case_save_job(context):
+    "Saves titration as uncompressed job file"
+    path = os.path.join(context.directory, 'bench.s2m')
+    return lambda: context.titration.save(path)
+
+def case_load_job(context):
+    "Loads job file and outputs titration summary"
+    path = context.titration.save(os.path.join(context.directory, 'bench.s2m'))
+    def run():
+        with contextlib.redirect_stderr(io.StringIO()):
+            TitrationCLI(jobFile=path).summary
+    return run
+
+def case_hist(context):
+    "Creates last step histogram figure"
+    titration = context.titration
+    def run():
+        plt.close(Hist(titration.complete, titration.intensities[-1]).figure)
+    return run
+
+def case_multihist(context):
+    "Creates stacked histograms figure of all steps"
+    titration = context.titration
+    def run():
+        plt.close(MultiHist(titration.complete, titration.intensities[1:]).figure)
+    return run
+
+def case_shiftmap(context):
+    "Creates shift map figure of complete residues"
+    residues = list(context.titration.complete.values())
+    def run():
+        plt.close(ShiftMap(residues).figure)
+    return run
+
+def case_curve(context):
+    "Creates titration curve figure of a residue"
+    titration = context.titration
+    residue = next(iter(titration.complete.values()))
+    def run():
+        plt.close(TitrationCurve(titration.concentrationRatio[:titration.dataSteps], residue).figure)
+    return run
+
+CASES = OrderedDict([
+    ("parse", case_parse),
+    ("ingest", case_ingest),
+    ("load_cold", case_load_cold),
+    ("load_warm", case_load_warm),
+    ("intensities", case_intensities),
+    ("filtered", case_filtered),
+    ("filtered_warm", case_filtered_warm),
+    ("protocole", case_protocole),
+    ("save_job", case_save_job),
+    ("load_job", case_load_job),
+    ("hist", case_hist),
+    ("multihist", case_multihist),
+    ("shiftmap", case_shiftmap),
+    ("curve", case_curve)
+])
+PLOT_CASES = ("hist", "multihist", "shiftmap", "curve")
+
+## -----------------------------------------------------
+##         Harness
+## -----------------------------------------------------
+
+def time_case(function, repeat):
+    "Returns list of `repeat` wall clock timings of `function`, in seconds"
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def run_benchmarks(residuesCounts, stepsCounts, cases, repeat=3, plotMax=1000):
+    "Runs `cases` for each size, returns list of result dicts"
+    results = []
+    for residues in residuesCounts:
+        for steps in stepsCounts:
+            context = Context(residues, steps)
+            try:
+                for name in cases:
+                    if name in PLOT_CASES and residues > plotMax:
+                        continue
+                    timings = time_case(CASES[name](context), repeat)
+                    results.append({
+                        "case" : name,
+                        "residues" : residues,
+                        "steps" : steps,
+                        "timings" : timings,
+                        "best" : min(timings),
+                        "median" : float(np.median(timings))
+                    })
+                    print("{case:<15}{residues:>8} residues {steps:>5} steps : {best:.4f} s".format(
+                        **results[-1]), file=sys.stderr)
+            finally:
+                context.close()
+    return results
+
+def revision():
+    "Returns current git revision of repository, or None"
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metadata():
+    "Returns environment description stored along with results"
+    return {
+        "version" : FORMAT_VERSION,
+        "revision" : revision(),
+        "date" : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "matplotlib" : matplotlib.__version__,
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count()
+    }
+
+def compare(before, after, threshold=1.2):
+    "Returns comparison table of best timings of two results dicts, as a list of rows"
+    key = lambda result: (result["case"], result["residues"], result["steps"])
+    beforeResults = dict((key(result), result) for result in before["results"])
+    rows = []
+    for result in after["results"]:
+        previous = beforeResults.get(key(result))
+        if previous is None:
+            continue
+        ratio = result["best"] / previous["best"] if previous["best"] else float('inf')
+        status = "slower" if ratio > threshold else ("faster" if ratio < 1 / threshold else "")
+        rows.append(list(key(result)) + [previous["best"], result["best"], ratio, status])
+    return rows
+
+
+if __name__ == '__main__':
+    ARGS = docopt(__doc__)
+    if ARGS["--compare"]:
+        RESULTS = []
+        for path in (ARGS["<before.json>"], ARGS["<after.json>"]):
+            with open(path) as resultsFile:
+                RESULTS.append(json.load(resultsFile))
+        print("Comparing {before} to {after}".format(
+            before=RESULTS[0]["metadata"]["revision"], after=RESULTS[1]["metadata"]["revision"]))
+        print(tabulate(compare(*RESULTS, threshold=float(ARGS["--threshold"])),
+                    headers=["case", "residues", "steps", "before (s)", "after (s)", "ratio", ""],
+                    tablefmt='psql', floatfmt='.4g'))
+        exit(0)
+
+    CASE_NAMES = ARGS["--cases"].split(',') if ARGS["--cases"] else list(CASES)
+    UNKNOWN = [name for name in CASE_NAMES if name not in CASES]
+    if UNKNOWN:
+        print("Unknown cases : {cases}. Accepted are {accepted}".format(
+            cases=', '.join(UNKNOWN), accepted=', '.join(CASES)), file=sys.stderr)
+        exit(1)
+    RESULTS = run_benchmarks([int(count) for count in ARGS["--residues"].split(',')],
+                            [int(count) for count in ARGS["--steps"].split(',')],
+                            CASE_NAMES,
+                            repeat=int(ARGS["--repeat"]),
+                            plotMax=int(ARGS["--plot-max"]))
+    with open(ARGS["--output"], 'w') as outputFile:
+        json.dump({"metadata" : metadata(), "results" : RESULTS}, outputFile, indent=2)
+    print("Results written to {output}".format(output=ARGS["--output"]))
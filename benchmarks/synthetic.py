@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+"""
+Synthetic titration generator.
+Writes a titration series as Sparky `.list` files, one per step, along with its protocole file.
+Residues are spread over a position range with unassigned gaps, some peaks are missing at some steps,
+and a fraction of residues bind titrant following a single site binding model.
+
+Run from repository root, as `python -m benchmarks.synthetic`.
+
+Usage:
+    synthetic [options] <dir>
+    synthetic -h
+
+Options:
+  -r <residues>, --residues=<residues>     Number of assigned residues [default: 200]
+  -s <steps>, --steps=<steps>              Number of titration steps, including reference [default: 11]
+  -g <gaps>, --gaps=<gaps>                 Fraction of unassigned positions within residue range [default: 0.05]
+  -m <missing>, --missing=<missing>        Probability of a peak missing at a step [default: 0.005]
+  -b <binders>, --binders=<binders>        Fraction of residues binding titrant [default: 0.1]
+  -k <kd>, --kd=<kd>                       Dissociation constant, in µM [default: 20]
+  --seed=<seed>                            Random seed [default: 0]
+  -z, --gzip                               Write gzip compressed `.list.gz` files
+  -h --help                                Print help and usage
+"""
+
+import gzip
+import os
+
+import numpy as np
+from docopt import docopt
+
+from classes.Titration import BaseTitration
+from classes import fitting
+
+# protocole of generated titrations : titrant is added up to a 4 fold excess over analyte
+PROTOCOLE = {
+    "titrant" : {"name" : "titrant", "concentration" : 1000},
+    "analyte" : {"name" : "analyte", "concentration" : 250},
+    "start_volume" : {"analyte" : 200, "total" : 400}
+}
+TOTAL_TITRANT_VOLUME = 600
+# chem shifts distributions (ppm) : mean, standard deviation, bounds, binding shift amplitude, measure noise
+CHEMSHIFT_H = (8.2, 0.6, (6.0, 10.5), 0.3, 0.002)
+CHEMSHIFT_N = (119.0, 4.0, (100.0, 135.0), 1.5, 0.02)
+LINE_FORMAT = "{position:>12d}N-H {chemshiftN:>10.3f} {chemshiftH:>10.3f} \n"
+HEADER = "      Assignment         w1         w2  \n\n"
+
+def make_protocole(steps, name='synthetic'):
+    "Returns titration init dict for `steps` steps, with equal titrant volumes added at each step"
+    volumes = [0] + [TOTAL_TITRANT_VOLUME / max(steps - 1, 1)] * (steps - 1)
+    return dict(PROTOCOLE, name=name, add_volumes=volumes)
+
+def make_series(residues=200, steps=11, gaps=0.05, missing=0.005, binders=0.1, kd=20, seed=0):
+    """
+    Returns (positions, chemshifts, present) arrays of a synthetic titration :
+        - positions of assigned residues
+        - (step x residue x nucleus) H and N chem shifts
+        - (step x residue) boolean array, False for missing peaks
+    """
+    random = np.random.RandomState(seed)
+    # spread residues over a larger position range, leaving unassigned positions
+    positionRange = int(round(residues / (1 - gaps))) if gaps < 1 else residues
+    positions = np.sort(random.choice(positionRange, residues, replace=False)) + 1 + random.randint(200)
+
+    titrant, analyte = BaseTitration(**make_protocole(steps)).concentrations
+    bound = fitting.bound_fraction(kd, titrant, analyte)
+
+    chemshifts = np.empty((steps, residues, 2))
+    binding = random.rand(residues) < binders
+    for nucleus, (mean, deviation, bounds, amplitude, noise) in enumerate((CHEMSHIFT_H, CHEMSHIFT_N)):
+        free = np.clip(random.normal(mean, deviation, residues), *bounds)
+        # binding residues shift in a random direction, proportionally to bound fraction
+        shift = random.normal(0, amplitude, residues) * binding
+        chemshifts[..., nucleus] = (free + bound[:, np.newaxis] * shift
+                                    + random.normal(0, noise, (steps, residues)))
+    present = random.rand(steps, residues) >= missing
+    return positions, chemshifts, present
+
+def write_series(directory, positions, chemshifts, present, name='synthetic', compress=False):
+    "Writes titration series as one `.list` file per step in `directory`. Returns list of written files."
+    os.makedirs(directory, exist_ok=True)
+    steps = len(chemshifts)
+    width = max(2, len(str(steps - 1)))
+    files = []
+    for step in range(steps):
+        path = os.path.join(directory, "{name}_{step:0{width}d}.list".format(name=name, step=step, width=width))
+        lines = [LINE_FORMAT.format(position=position, chemshiftH=chemshiftH, chemshiftN=chemshiftN)
+                for position, (chemshiftH, chemshiftN) in zip(positions[present[step]].tolist(),
+                                                            chemshifts[step][present[step]].tolist())]
+        content = HEADER + "".join(lines)
+        if compress:
+            path += '.gz'
+            with gzip.open(path, 'wt') as listFile:
+                listFile.write(content)
+        else:
+            with open(path, 'w') as listFile:
+                listFile.write(content)
+        files.append(path)
+    return files
+
+def generate(directory, residues=200, steps=11, gaps=0.05, missing=0.005, binders=0.1, kd=20,
+            seed=0, name='synthetic', compress=False):
+    """
+    Writes a synthetic titration series in `directory`, along with its `titration.yml` protocole file.
+    See make_series() for parameters. Returns list of written titration files.
+    """
+    files = write_series(directory, *make_series(residues, steps, gaps, missing, binders, kd, seed),
+                        name=name, compress=compress)
+    BaseTitration(**make_protocole(steps, name)).dump_init_file(os.path.join(directory, 'titration.yml'))
+    return files
+
+
+if __name__ == '__main__':
+    ARGS = docopt(__doc__)
+    FILES = generate(ARGS["<dir>"],
+                    residues=int(ARGS["--residues"]),
+                    steps=int(ARGS["--steps"]),
+                    gaps=float(ARGS["--gaps"]),
+                    missing=float(ARGS["--missing"]),
+                    binders=float(ARGS["--binders"]),
+                    kd=float(ARGS["--kd"]),
+                    seed=int(ARGS["--seed"]),
+                    compress=ARGS["--gzip"])
+    print("Generated {count} titration files in {dir}".format(count=len(FILES), dir=ARGS["<dir>"]))
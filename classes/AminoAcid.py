@@ -6,47 +6,69 @@ Authors : Hermès PARAQUINDES, Louis Duchemin, Marc-Antoine GUENY and Rainier-Nu
 
 
 
-import math
-import sys
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from classes.ChemshiftStore import ChemshiftStore
 
 
 class AminoAcid(object):
     """
     Class AminoAcid
     Describes a amino-acid using its position number in the proteic sequence.
-    An AminoAcid object contains the values of measured chemical shift at each titration step.
-    These data are split in two lists, one contains the hydrogen chem shift data, the other contains nitrogen chem shifts data.
-    The first element of each list is used as a reference value for calculating difference in chemical shifts at each titration step, i.e measured chem shift - ref chem shift.
+    An AminoAcid object is a view onto one row of a ChemshiftStore, which contains the values
+    of measured chemical shift at each titration step, for both hydrogen and nitrogen.
+    The first element of each chem shift array is used as a reference value for calculating difference in chemical shifts at each titration step, i.e measured chem shift - ref chem shift.
+    When bound to a titration, reference step and intensity weights are those of the titration,
+    and intensities of complete residues are read from the titration cached intensity matrix.
+    A residue without any data has no row in store, until data is added for it.
     """
 
+    __slots__ = ('position', 'titration', 'store', '_row', 'code')
+
+    # (H, N) weights for calculating chem shift intensity
+    INTENSITY_WEIGHTS = (1, 0.2)
+
     def __init__(self, **kwargs):
         """
         Initialize AminoAcid object, only required argument is position.
-        If chemshiftH and chemshiftN are provided, use them to start both chemical shift lists.
+        If `titration` or `store` is provided, AminoAcid is bound to the row matching its position in store,
+        else it uses a store of its own.
+        If chemshiftH and chemshiftN are provided, use them to start both chemical shift arrays.
         """
         self.position = int(kwargs["position"])
-        self.chemshiftH = [float(kwargs["chemshiftH"])] if kwargs.get("chemshiftH") else []
-        self.chemshiftN = [float(kwargs["chemshiftN"])] if kwargs.get("chemshiftN") else []
-        self._deltaChemshiftH = None
-        self._deltaChemshiftN = None
-        self._chemshiftIntensity = None
+        self.titration = kwargs.get("titration")
+        if self.titration is not None:
+            self.store = self.titration.store
+        else:
+            # an empty shared store is falsy, as its length is 0
+            self.store = kwargs.get("store")
+            if self.store is None:
+                self.store = ChemshiftStore()
+        self._row = None
         self.code = kwargs.get('code')
+        if kwargs.get("chemshiftH") or kwargs.get("chemshiftN"):
+            self.add_chemshifts(**kwargs)
 
     def __str__(self):
-        return str((self.position, self.chemshiftH, self.chemshiftN))
+        return str((self.position, list(self.chemshiftH), list(self.chemshiftN)))
 
     def __repr__(self):
         return self.__str__()
 
     def add_chemshifts(self, **kwargs):
         """
-        Append chemical shifts to object's lists of chemical shifts
-        If one of the values is missing, None or 0, it is ignored.
+        Set chemical shifts at last titration step in store, if no data is set for this step yet.
+        Otherwise a new step is added to the store.
+        If one of the values is missing, None or 0, it is flagged as missing.
         """
-        if kwargs.get("chemshiftH") and float(kwargs["chemshiftH"]) != 0:
-            self.chemshiftH.append(float(kwargs["chemshiftH"]))
-        if kwargs.get("chemshiftN") and float(kwargs["chemshiftN"]) != 0:
-            self.chemshiftN.append(float(kwargs["chemshiftN"]))
+        self._row = self.store.add_position(self.position)
+        if not self.store.steps or not self.store.missing[self.row, -1].all():
+            self.store.add_step()
+        self.store.set_chemshifts(self.store.steps - 1, self.position,
+                                float(kwargs.get("chemshiftH") or 0),
+                                float(kwargs.get("chemshiftN") or 0))
 
     def validate(self, titrationSteps):
         """
@@ -58,30 +80,67 @@ class AminoAcid(object):
 ##      PROPERTIES
 ## -----------------------------------------------------------
 
+    @property
+    def row(self):
+        "Index of residue row in store, None if there is no data for this residue"
+        if self._row is None:
+            self._row = self.store.rows.get(self.position)
+        return self._row
+
+    @property
+    def reference(self):
+        "Reference step index"
+        return self.titration.reference if self.titration is not None else 0
+
+    @property
+    def weights(self):
+        "(H, N) weights for calculating chem shift intensity"
+        return self.titration.weights if self.titration is not None else self.INTENSITY_WEIGHTS
+
+    @property
+    def chemshiftH(self):
+        "Array of measured hydrogen chem shifts, missing steps excluded"
+        return self._chemshifts(ChemshiftStore.H)
+
+    @property
+    def chemshiftN(self):
+        "Array of measured nitrogen chem shifts, missing steps excluded"
+        return self._chemshifts(ChemshiftStore.N)
+
+    def _chemshifts(self, nucleus):
+        "Returns chem shifts from store row for `nucleus`, dropping missing values"
+        if self.row is None:
+            return np.zeros(0)
+        values = self.store.chemshifts[self.row, :, nucleus]
+        missing = self.store.missing[self.row, :, nucleus]
+        return values[~missing] if missing.any() else values
+
     @property
     def deltaChemshiftH(self):
         """
-        Calculates distance to the reference for each chemical shift only once for hydrogen.
+        Calculates distance to the reference for each chemical shift for hydrogen.
         """
-        try :
-            self._deltaChemshiftH = tuple([dH - self.chemshiftH[0] for dH in self.chemshiftH])
-            return self._deltaChemshiftH
-        except IndexError as missingDataError:
-            sys.stderr.write("Could not calculate chem shift variation for residue %s : missing H chem shift data" % self.position)
-            exit(1)
-
+        return self._deltaChemshifts(ChemshiftStore.H)
 
     @property
     def deltaChemshiftN(self):
         """
-        Calculates distance to the reference for each chemical shift only once for nitrogen.
+        Calculates distance to the reference for each chemical shift for nitrogen.
         """
-        try:
-            self._deltaChemshiftN = tuple([dN - self.chemshiftN[0] for dN in self.chemshiftN])
-            return self._deltaChemshiftN
-        except IndexError as missingDataError:
-            sys.stderr.write("Could not calculate chem shift variation for residue %s : missing N chem shift data" % self.position)
-            exit(1)
+        return self._deltaChemshifts(ChemshiftStore.N)
+
+    def _deltaChemshifts(self, nucleus):
+        """
+        Returns chem shift variations to reference step for `nucleus`, dropping missing values.
+        If reference chem shift is missing, first measured one is used instead.
+        Residues without data get an empty array.
+        """
+        chemshifts = self._chemshifts(nucleus)
+        if not len(chemshifts):
+            return chemshifts
+        if self.reference < self.store.steps and not self.store.missing[self.row, self.reference, nucleus]:
+            return chemshifts - self.store.chemshifts[self.row, self.reference, nucleus]
+        return chemshifts - chemshifts[0]
 
     @property
     def deltaChemshifts(self):
@@ -100,24 +159,76 @@ class AminoAcid(object):
         """
         Calculate chemical shift intensity at each titration step from chemical shift values for hydrogen and nitrogen.
         """
-        self._chemshiftIntensity = tuple([math.sqrt(ddH**2 + (ddN/5)**2) for (ddH, ddN) in self.deltaChemshifts])
-        return self._chemshiftIntensity
+        if self.titration is not None and self.row is not None and not self.store.missing[self.row].any():
+            return self.titration.row_intensities(self.row)
+        weightH, weightN = self.weights
+        deltaH, deltaN = self.deltaChemshiftH, self.deltaChemshiftN
+        steps = min(len(deltaH), len(deltaN))
+        return np.sqrt((deltaH[:steps] * weightH)**2 + (deltaN[:steps] * weightN)**2)
 
 
     @property
     def arrow(self):
         "Chem shift vector start/end coords calculated on first and last step chem shift data"
-        return (self.chemshiftH[0],
-                self.chemshiftN[0],
-                self.chemshiftH[-1] - self.chemshiftH[0],
-                self.chemshiftN[-1] - self.chemshiftN[0])
+        chemshiftH, chemshiftN = self.chemshiftH, self.chemshiftN
+        return (chemshiftH[0],
+                chemshiftN[0],
+                chemshiftH[-1] - chemshiftH[0],
+                chemshiftN[-1] - chemshiftN[0])
 
     @property
     def rangeH(self):
         "Distance between max and min H chem shift"
-        return max(self.chemshiftH) - min(self.chemshiftH)
+        return np.ptp(self.chemshiftH)
 
     @property
     def rangeN(self):
         "Distance between max and min N chem shift"
-        return max(self.chemshiftN) - min(self.chemshiftN)
+        return np.ptp(self.chemshiftN)
+
+
+class ResidueDict(MutableMapping):
+    """
+    Class ResidueDict
+    Ordered {position: AminoAcid} mapping, creating AminoAcid objects on first access only.
+    Missing residues are obtained by calling `lookup` with their position,
+    e.g. building a new AminoAcid view, or fetching it from another mapping.
+    Used by titrations, so that residues never looked at cost nothing.
+    """
+
+    def __init__(self, lookup, positions=()):
+        self.lookup = lookup
+        self._residues = dict.fromkeys(positions)
+
+    def add(self, positions):
+        "Adds residues at `positions`, to be looked up on first access. Known positions are left unchanged."
+        for position in positions:
+            self._residues.setdefault(position, None)
+
+    def __getitem__(self, position):
+        residue = self._residues[position]
+        if residue is None:
+            residue = self._residues[position] = self.lookup(position)
+        return residue
+
+    def __setitem__(self, position, residue):
+        self._residues[position] = residue
+
+    def __delitem__(self, position):
+        del self._residues[position]
+
+    def __contains__(self, position):
+        return position in self._residues
+
+    def clear(self):
+        "Removes all residues, without looking them up as MutableMapping.clear() would"
+        self._residues.clear()
+
+    def __iter__(self):
+        return iter(self._residues)
+
+    def __len__(self):
+        return len(self._residues)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,155 @@
+""" ChemshiftStore class module
+
+Dense storage of chemical shifts measured at each titration step.
+Data is held in a single (residue x step x nucleus) float array, along with a
+boolean mask of the same shape flagging missing data.
+Each row of the array describes a residue, identified by its position in the proteic sequence.
+"""
+
+import numpy as np
+
+
+class ChemshiftStore(object):
+    """
+    Class ChemshiftStore.
+    Holds chemical shifts for all residues and all titration steps.
+    Nucleus axis is ordered as (H, N).
+    Missing values are stored as NaN and flagged as True in the missing data mask.
+    Arrays are over-allocated, so that adding residues or steps does not copy data each time.
+    """
+
+    NUCLEI = ('H', 'N')
+    H, N = 0, 1
+
+    def __init__(self):
+        self.rows = dict() # {position: row index}
+        self.size = 0 # number of residues
+        self.steps = 0 # number of titration steps
+        self._positions = np.zeros(0, dtype=int)
+        self._data = np.full((0, 0, len(self.NUCLEI)), np.nan)
+        self._missing = np.ones((0, 0, len(self.NUCLEI)), dtype=bool)
+        self._index = None # (sorted positions, matching rows), see find_rows()
+
+    @classmethod
+    def from_arrays(cls, positions, chemshifts, missing):
+        """
+        Returns a store holding given arrays, as returned by positions, chemshifts and missing properties.
+        Arrays are used as is, without copy.
+        """
+        store = cls()
+        store._positions, store._data, store._missing = positions, chemshifts, missing
+        store.size, store.steps = chemshifts.shape[:2]
+        store.rows = {position: row for row, position in enumerate(positions.tolist())}
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, position):
+        return position in self.rows
+
+## -----------------------------------------------------------
+##      Manipulation methods
+## -----------------------------------------------------------
+
+    def copy_arrays(self):
+        "Replaces arrays by in memory copies, e.g when they are mapped onto a file about to be overwritten"
+        self._positions, self._data, self._missing = (np.array(array) for array in
+                                                    (self._positions, self._data, self._missing))
+
+    def reserve(self, size, steps):
+        "Ensure arrays can hold at least `size` residues and `steps` titration steps"
+        capSize, capSteps = self._data.shape[:2]
+        if size <= capSize and steps <= capSteps:
+            return
+        # grow geometrically to keep additions amortized
+        newSize = max(size, 2 * capSize) if size > capSize else capSize
+        newSteps = max(steps, 2 * capSteps) if steps > capSteps else capSteps
+        shape = (newSize, newSteps, len(self.NUCLEI))
+
+        data = np.full(shape, np.nan)
+        data[:capSize, :capSteps] = self._data
+        missing = np.ones(shape, dtype=bool)
+        missing[:capSize, :capSteps] = self._missing
+        positions = np.zeros(newSize, dtype=int)
+        positions[:capSize] = self._positions
+
+        self._data, self._missing, self._positions = data, missing, positions
+
+    def add_position(self, position):
+        "Returns row index for residue at `position`, adding an empty row if needed"
+        row = self.rows.get(position)
+        if row is None:
+            row = self.size
+            self.reserve(self.size + 1, self.steps)
+            self._positions[row] = position
+            self.rows[position] = row
+            self.size += 1
+        return row
+
+    def find_rows(self, positions):
+        "Returns row index for each of `positions` array, -1 for unknown positions"
+        if self._index is None or len(self._index[0]) != self.size:
+            order = np.argsort(self.positions, kind='mergesort')
+            self._index = (self.positions[order], order)
+        sortedPositions, sortedRows = self._index
+        rows = np.full(len(positions), -1, dtype=int)
+        if not self.size:
+            return rows
+        found = np.minimum(np.searchsorted(sortedPositions, positions), self.size - 1)
+        known = sortedPositions[found] == positions
+        rows[known] = sortedRows[found[known]]
+        return rows
+
+    def add_step(self):
+        "Adds an empty titration step column, returning its index"
+        self.reserve(self.size, self.steps + 1)
+        self.steps += 1
+        return self.steps - 1
+
+    def set_chemshifts(self, step, positions, chemshiftH, chemshiftN):
+        """
+        Sets chemical shifts for residues at `positions` for titration step `step`.
+        Arguments may be scalars or sequences of equal length.
+        Null or NaN values are flagged as missing data.
+        """
+        positions = np.atleast_1d(positions).astype(int)
+        rows = self.find_rows(positions)
+        unknown = rows < 0
+        if unknown.any():
+            rows[unknown] = [self.add_position(int(pos)) for pos in positions[unknown]]
+        values = np.column_stack((np.atleast_1d(chemshiftH), np.atleast_1d(chemshiftN))).astype(float)
+        missing = np.isnan(values) | (values == 0)
+        values[missing] = np.nan
+        self._data[rows, step] = values
+        self._missing[rows, step] = missing
+        return rows
+
+## -----------------------------------------------------------
+##      Properties
+## -----------------------------------------------------------
+
+    @property
+    def positions(self):
+        "Residue position for each row"
+        return self._positions[:self.size]
+
+    @property
+    def chemshifts(self):
+        "(residue x step x nucleus) view of chemical shifts"
+        return self._data[:self.size, :self.steps]
+
+    @property
+    def missing(self):
+        "(residue x step x nucleus) view of missing data mask"
+        return self._missing[:self.size, :self.steps]
+
+    @property
+    def nbytes(self):
+        "Memory allocated for store arrays, in bytes, including room left for next residues and steps"
+        return self._data.nbytes + self._missing.nbytes + self._positions.nbytes
+
+    @property
+    def complete(self):
+        "Boolean array flagging rows having data for each nucleus at each step"
+        return ~self.missing.any(axis=(1, 2))
@@ -8,26 +8,30 @@ The class provides matplotlib wrapping functions, allowing to display the data f
 as well as setting a cut-off to filter residues having high intensity values.
 """
 
+import io
 import os
 import glob
-import pickle
 import re
 import sys
 import csv
+import threading
 import json
 import yaml
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, repeat
 from math import *
 
-import pandas as pd
-
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.ticker import FormatStrFormatter
 
-from classes.AminoAcid import AminoAcid
-from classes.plots import Hist, MultiHist, ShiftMap, SplitShiftMap, TitrationCurve
-from classes.widgets import CutOffCursor
+from classes.AminoAcid import AminoAcid, ResidueDict
+from classes.ChemshiftStore import ChemshiftStore
+from classes import archives
+from classes import fitting
+from classes.cache import ParseCache
+from classes.metrics import Metrics
+from classes.watcher import StepWatcher
+from classes import job
 
 
 ## --------------------------------------------------------------------
@@ -38,8 +42,18 @@ represent_dict_order = lambda self, data: self.represent_mapping('tag:yaml.org,2
 """ setup YAML for ordered dict output : https://stackoverflow.com/a/8661021 """
 yaml.add_representer(OrderedDict, represent_dict_order)
 
-# Setup pandas float precision
-pd.set_option('precision', 3)
+# pandas and matplotlib are slow to import : they are imported on first use,
+# so that template generation, job handling and headless runs do not pay for them
+pd = None
+
+def import_pandas():
+    "Imports pandas on first call, setting its float precision. Returns pandas module."
+    global pd
+    if pd is None:
+        import pandas
+        pandas.set_option('precision', 3)
+        pd = pandas
+    return pd
 
 
 ## --------------------------------------------------------------------
@@ -69,6 +83,7 @@ class BaseTitration(object):
         self.analyteStartVol = 0
 
         self.volumes = [0]
+        self._protocoleColumns = None # cached protocole arrays, see protocoleColumns
 
         if initStream is not None: # init from file
             self.load_init_file(initStream)
@@ -76,7 +91,7 @@ class BaseTitration(object):
             self.load_init_dict(kwargs)
 
 ## ----------------------------------------------------------
-##      Protocole using pandas
+##      Protocole
 ## ----------------------------------------------------------
 ## ----------------------------------------------------------
     @property
@@ -84,38 +99,54 @@ class BaseTitration(object):
         return self.make_protocole()
 
     def make_protocole(self, index=True):
-        self._protocole = pd.DataFrame(index=list(range(self.steps)) or [0], columns=self.COLUMN_ALIASES, data=0)
-        self.update_protocole()
-        self.set_protocole_headers()
+        """
+        Returns protocole as a pandas DataFrame for display, with molecule names in headers.
+        Built from cached protocoleColumns on each call, indexed by step if `index` is set.
+        """
+        pd = import_pandas()
+        columns = self.protocoleColumns
+        protocole = pd.DataFrame(OrderedDict((alias, columns[alias]) for alias in self.COLUMN_ALIASES))
+        protocole.columns = self.protocoleHeaders
         if index:
-            self._protocole.set_index('Step', inplace=True)
-        return self._protocole
-
-
-    def update_protocole(self):
-        self._protocole['step'] = list(range(self.steps))
-        self._protocole['vol_add'] = self.volumes
-        self._protocole['vol_titrant'] = self._protocole['vol_add'].cumsum()
-        self._protocole['vol_total'] = self.startVol + self._protocole['vol_titrant']
-        self._protocole['conc_titrant'] = self._protocole['vol_titrant'] * self.titrant['concentration'] / self._protocole['vol_total']
-        self._protocole['conc_analyte'] = self.analyteStartVol * self.analyte['concentration'] / self._protocole['vol_total']
-        self._protocole['ratio'] = self._protocole['conc_titrant'] / self._protocole['conc_analyte']
-
-    def set_protocole_headers(self):
-        headers = list(map(
-            lambda s: s.format(
-                titrant=self.titrant['name'],
-                analyte=self.analyte['name']),
-            [
+            protocole.set_index('Step', inplace=True)
+        return protocole
+
+    @property
+    def protocoleColumns(self):
+        """
+        Protocole as a dict of read only arrays, one per COLUMN_ALIASES column, with a value per step.
+        Calculated on first access, and cached until volumes or concentrations change, see invalidate_protocole().
+        """
+        if self._protocoleColumns is None:
+            volumes = np.array(self.volumes, dtype=float)
+            columns = {"step": np.arange(len(volumes)), "vol_add": volumes}
+            columns["vol_titrant"] = volumes.cumsum()
+            columns["vol_total"] = self.startVol + columns["vol_titrant"]
+            # protocole may not be set yet, concentrations are then undefined
+            with np.errstate(divide='ignore', invalid='ignore'):
+                columns["conc_titrant"] = columns["vol_titrant"] * self.titrant['concentration'] / columns["vol_total"]
+                columns["conc_analyte"] = self.analyteStartVol * self.analyte['concentration'] / columns["vol_total"]
+                columns["ratio"] = columns["conc_titrant"] / columns["conc_analyte"]
+            for column in columns.values():
+                column.flags.writeable = False
+            self._protocoleColumns = columns
+        return self._protocoleColumns
+
+    def invalidate_protocole(self):
+        "Drops cached protocole columns, which will be recalculated on next access"
+        self._protocoleColumns = None
+
+    @property
+    def protocoleHeaders(self):
+        "Protocole column headers for display, in COLUMN_ALIASES order"
+        return [header.format(titrant=self.titrant['name'], analyte=self.analyte['name']) for header in (
                 'Step',
                 'Added {titrant} (µL)',
                 'Total {titrant} (µL)',
                 'Total volume (µL)',
                 '[{titrant}] (µM)',
                 '[{analyte}] (µM)',
-                '[{titrant}]/[{analyte}]'
-            ]))
-        self._protocole.columns = list(headers)
+                '[{titrant}]/[{analyte}]')]
 
 ## -----------------------------------------------------
 ##         Input/output
@@ -241,6 +272,7 @@ class BaseTitration(object):
         self.startVol = float(initDict['start_volume']['total'])
         self.set_volumes(initDict.get('add_volumes', self.volumes))
         self.isInit = self.validate()
+        self.invalidate_protocole()
         return self.isInit
 
     def dump_init_file(self, initFile=None):
@@ -268,12 +300,14 @@ class BaseTitration(object):
         "Add a volume for next protocole step"
         self.steps += 1
         self.volumes.append(volume)
+        self.invalidate_protocole()
         return self.steps
 
     def set_volumes(self, volumes):
         "Set tiration volumes, updating steps to match number of volumes"
         self.steps = len(volumes)
         self.volumes = list(map(float, volumes))
+        self.invalidate_protocole()
 
     def update_volumes(self, stepVolumes):
         "Updates protocole volume from a dict \{step_nb: volume\}"
@@ -282,6 +316,12 @@ class BaseTitration(object):
                 self.volumes[step] = vol
         except IndexError:
             print("{step} does not exist".format(step=step), file=sys.stderr)
+        self.invalidate_protocole()
+
+    def set_concentration(self, role, concentration):
+        "Sets initial concentration of `role` molecule, either 'titrant' or 'analyte'"
+        getattr(self, role)['concentration'] = float(concentration)
+        self.invalidate_protocole()
 
     def add_volumes(self, volumes):
         "Add a list of volumes for next protocole steps"
@@ -298,6 +338,16 @@ class BaseTitration(object):
     def is_consistent(self):
         return True if len(self.volumes) == self.steps else False
 
+    @property
+    def concentrations(self):
+        "Returns ([titrant], [analyte]) concentrations at each step, as read only arrays"
+        return self.protocoleColumns['conc_titrant'], self.protocoleColumns['conc_analyte']
+
+    @property
+    def concentrationRatio(self):
+        "[titrant]/[analyte] ratio at each step, as list"
+        return self.protocoleColumns['ratio'].tolist()
+
     @property
     def as_init_dict(self):
         initDict=OrderedDict({"_description" : "This file defines a titration's initial parameters."})
@@ -322,7 +372,8 @@ class BaseTitration(object):
 class Titration(BaseTitration):
     """
     Class Titration.
-    Contains a list of aminoacid objects
+    Chemical shifts are held in a ChemshiftStore, as a (residue x step x nucleus) array.
+    Contains a dict of aminoacid objects, each one being a view onto a row of the store.
     Provides methods for accessing each titration step datas.
     """
     # accepted file path pattern
@@ -333,6 +384,22 @@ class Titration(BaseTitration):
                             r'(?P<chemshiftH>\d+\.\d+)$')
     # ignored lines pattern
     IGNORE_LINE_PATTERN = re.compile(r"^\d.*")
+    # max length of chem shift tokens handled by bulk parser
+    TOKEN_WIDTH = 15
+    # attributes and arrays saved in job files
+    JOB_ATTRIBUTES = ('name', 'isInit', 'steps', 'titrant', 'analyte', 'startVol', 'analyteStartVol',
+                    'dataSteps', 'files', 'cutoff', 'reference', 'weights')
+    JOB_ARRAYS = ('positions', 'stepChemshifts', 'stepMissing', 'complete', 'incomplete', 'selected', 'volumes')
+    # binding fit results columns, see fit_binding() and fit_global()
+    FIT_COLUMNS = ('Kd', 'deltaMax', 'rss', 'r2', 'bounded')
+    GLOBAL_FIT_COLUMNS = ('Kd', 'KdError', 'deltaMax', 'rss', 'r2', 'bounded', 'outlier')
+    # residues are fitted by chunks, in parallel processes
+    FIT_CHUNK = 500
+    FIT_WORKERS = os.cpu_count() or 1
+    # number of processes drawing split shift map pages
+    PLOT_WORKERS = os.cpu_count() or 1
+    # bootstrap replicates are fitted by batches of about BOOTSTRAP_CURVES curves
+    BOOTSTRAP_CURVES = 20000
 
 
     def __init__(self, name=None, cutoff=None, **kwargs):
@@ -346,16 +413,31 @@ class Titration(BaseTitration):
 
         self.name = ""
 
-        self.residues = dict() # all residues {position:AminoAcid object}
-        self.complete = dict() # complete data residues
-        self.incomplete = dict() # incomplete data residues
-        self.selected = dict() # selected residues
-        self.intensities = list() # 2D array of intensities
+        self.store = ChemshiftStore() # (residue x step x nucleus) chem shifts array
+        self.residues = ResidueDict(self.make_residue) # all residues {position:AminoAcid object}
+        self.complete = ResidueDict(self.residues.__getitem__) # complete data residues
+        self.incomplete = ResidueDict(self.residues.__getitem__) # incomplete data residues
+        self.selected = ResidueDict(self.residues.__getitem__) # selected residues
+        self.completeRows = np.zeros(0, dtype=int) # store rows of complete residues
+
+        # chem shift intensity parameters
+        self.reference = 0 # reference step index
+        self.weights = AminoAcid.INTENSITY_WEIGHTS # (H, N) chem shift weights
+
+        # cached intensity arrays, see invalidate_intensities()
+        self._intensityMatrix = None
+        self._intensities = None
+        self._intensityIndex = dict() # {step: sorted intensity index}, see intensity_index()
+
+        self.bindingFit = None # binding fit results, see fit_binding()
+        self.bindingReplicates = None # bootstrap replicates of binding fit, see bootstrap_fit()
 
         self.dataSteps = 0
         self.cutoff = None
 
         self.files = []
+        self.parseCache = None # ParseCache instance, see parse_titration_file()
+        self.metrics = Metrics() # parse, completeness, intensities and plotting metrics, see stats
 
         #BaseTitration.__init__(self)
 
@@ -378,8 +460,12 @@ class Titration(BaseTitration):
     def set_sequence(self, sequence, offset=0):
         raise NotImplementedError
 
-    def add_step(self, fileName, titrationStream, volume=None):
-        "Adds a titration step described in `titrationFile`"
+    def add_step(self, fileName, titrationStream, volume=None, parsed=None):
+        """
+        Adds a titration step described in `titrationFile`
+        If `parsed` is provided, it is a future holding the result of parse_titration_file,
+        computed beforehand, and `titrationStream` is ignored.
+        """
         print("[Step {step}]\tLoading NMR data from {titration_file}".format(
             step=self.dataSteps, titration_file=fileName),
             file=sys.stderr)
@@ -388,15 +474,29 @@ class Titration(BaseTitration):
         step = self.validate_filepath(fileName, verifyStep=True)
         # parse it
         try:
-            self.parse_titration_file(titrationStream)
+            if parsed is not None:
+                chemshifts = parsed.result()
+            else:
+                chemshifts = self.parse_titration_file(titrationStream)
         except ValueError as parseError:
             print("{error} in file {file}.".format(
                 error=parseError, file=fileName),
                 file=sys.stderr)
             return
 
+        self.ingest_step(fileName, chemshifts, volume=volume, step=step)
+
+    def ingest_step(self, fileName, chemshifts, volume=None, step=None):
+        """
+        Adds parsed chem shifts from `fileName` as next titration step.
+        Only the new step is processed : store gets a new column, completeness is updated in place
+        for residues losing data, and cached intensities are extended by one step.
+        """
+        step = self.dataSteps if step is None else step
         self.dataSteps += 1
         self.files.append(fileName)
+        self.bindingFit = None
+        self.bindingReplicates = None
 
         if volume is not None:
             if self.steps < self.dataSteps:
@@ -404,33 +504,343 @@ class Titration(BaseTitration):
             else:
                 super().update_volumes({step:volume})
 
-
-        # create residues with no data for missing positions
-        for pos in range(min(self.residues), max(self.residues)):
-            if pos not in self.residues:
-                self.residues.update({pos: AminoAcid(position=pos)})
-
-        # reset complete residues and update
-        self.complete = dict()
-        for pos, res in self.residues.items():
-            if res.validate(self.dataSteps):
-                self.complete.update({pos:res})
-            else:
-                self.incomplete.update({pos:res})
+        # positions range before adding new data
+        knownRange = (int(self.store.positions.min()), int(self.store.positions.max())) if self.store.size else None
+
+        # add step data to store
+        newStep = self.store.add_step()
+        newPositions = self.add_chemshifts(chemshifts)
+
+        # add residues with no data for missing positions, they get no row in store
+        # positions within previously known range are all set already
+        positions = chemshifts["position"]
+        if len(positions):
+            start, stop = int(positions.min()), int(positions.max())
+            gaps = range(start, stop) if knownRange is None else chain(
+                range(start, knownRange[0]), range(knownRange[1] + 1, stop))
+            gaps = [pos for pos in gaps if pos not in self.residues]
+            self.residues.add(gaps)
+            newPositions += gaps
+
+        # update complete residues in place
+        with self.metrics.time('completeness'):
+            stepComplete = ~self.store.missing[:, newStep].any(axis=1)
+            # residues with missing data at this step are not complete anymore
+            lostRows = self.completeRows[~stepComplete[self.completeRows]]
+            for pos in self.store.positions[lostRows].tolist():
+                del self.complete[pos]
+                self.incomplete.add([pos])
+            self.completeRows = self.completeRows[stepComplete[self.completeRows]]
+            # new residues are complete only if added at first step
+            newRows = self.store.find_rows(np.array(newPositions, dtype=int))
+            newComplete = (newRows >= 0) & stepComplete[newRows] if newStep == 0 else np.zeros(len(newRows), dtype=bool)
+            for pos, isComplete in zip(newPositions, newComplete.tolist()):
+                if isComplete:
+                    self.complete.add([pos])
+                else:
+                    self.incomplete.add([pos])
+            self.completeRows = np.concatenate((self.completeRows, newRows[newComplete]))
 
         print("\t\t{incomplete} incomplete residue out of {total}".format(
              incomplete=len(self.incomplete), total=len(self.residues)),
              file=sys.stderr)
 
-        # Recalculate (position, chem shift intensity) coordinates for histogram plot
-        self.intensities = [] # 2D array, by titration step then residu position
-        for step in range(self.dataSteps): # intensity is null for reference step, ignoring
-            self.intensities.append([residue.chemshiftIntensity[step] for residue in self.complete.values()])
+        # extend cached intensities with new step
+        self.extend_intensities(newStep)
 
     def set_cutoff(self, cutoff):
         "Sets cut off for all titration steps"
         raise NotImplementedError
 
+    def restore_job(self, attributes, arrays):
+        """
+        Restores titration state from job file content, replacing current state.
+        See job_attributes and job_arrays properties.
+        Arrays are used as is, so that memory mapped data is read only when needed,
+        and AminoAcid objects are created on first access.
+        """
+        if "chemshifts" in arrays: # job format version 1, (residue x step x nucleus) layout
+            arrays = dict(arrays, stepChemshifts=arrays["chemshifts"].transpose(1, 0, 2),
+                        stepMissing=arrays["missing"].transpose(1, 0, 2))
+        missingArrays = [name for name in self.JOB_ARRAYS if name not in arrays]
+        if missingArrays:
+            raise ValueError("Missing arrays in job file : {arrays}".format(arrays=', '.join(missingArrays)))
+        for attribute in self.JOB_ATTRIBUTES:
+            if attribute in attributes:
+                setattr(self, attribute, attributes[attribute])
+        self.weights = tuple(self.weights)
+        self.volumes = arrays["volumes"].tolist()
+        self.invalidate_protocole()
+
+        # store arrays are (residue x step x nucleus) views onto step major arrays
+        self.store = ChemshiftStore.from_arrays(arrays["positions"],
+                                                arrays["stepChemshifts"].transpose(1, 0, 2),
+                                                arrays["stepMissing"].transpose(1, 0, 2))
+        # residues without data have no row in store
+        residues = arrays.get("residues", self.store.positions)
+        self.residues = ResidueDict(self.make_residue, residues.tolist())
+        self.complete = ResidueDict(self.residues.__getitem__, arrays["complete"].tolist())
+        self.incomplete = ResidueDict(self.residues.__getitem__, arrays["incomplete"].tolist())
+        self.selected = ResidueDict(self.residues.__getitem__, arrays["selected"].tolist())
+        self.completeRows = self.store.find_rows(arrays["complete"])
+        self.invalidate_intensities()
+
+    def set_reference(self, step):
+        "Sets titration step used as reference for calculating chem shift variations"
+        if not 0 <= step < max(self.dataSteps, 1):
+            raise IndexError("Step {step} does not exist".format(step=step))
+        if step != self.reference:
+            self.reference = step
+            self.invalidate_intensities()
+
+    def set_weights(self, weightH=1, weightN=0.2):
+        "Sets H and N chem shift weights used when calculating chem shift intensities"
+        weights = (float(weightH), float(weightN))
+        if weights != self.weights:
+            self.weights = weights
+            self.invalidate_intensities()
+
+    def invalidate_intensities(self):
+        "Drops cached intensities, which will be recalculated on next access"
+        self._intensityMatrix = None
+        self._intensities = None
+        self._intensityIndex = dict()
+        self.bindingFit = None
+        self.bindingReplicates = None
+
+    def extend_intensities(self, step):
+        """
+        Appends intensities of titration step `step` to cached intensity matrix.
+        If there is no cached matrix, it will be fully calculated on next access.
+        Matrix is over-allocated along step axis, so that extending it does not copy data each time.
+        """
+        # complete residues may have changed
+        self._intensities = None
+        self._intensityIndex = dict()
+        if self._intensityMatrix is None or step == self.reference:
+            self._intensityMatrix = None
+            return
+        steps, size = self._intensityMatrix.shape
+        buffer = self._intensityMatrix.base
+        if buffer is None or buffer.shape[0] <= steps or buffer.shape[1] < self.store.size:
+            # new residues have no data at previous steps
+            buffer = np.full((max(2 * steps, steps + 1), self.store.size), np.nan)
+            buffer[:steps, :size] = self._intensityMatrix
+        with self.metrics.time('intensities'):
+            buffer[steps, :self.store.size] = self.calculate_intensities(step)
+        self._intensityMatrix = buffer[:steps + 1, :self.store.size]
+
+    def calculate_intensities(self, steps=slice(None), rows=slice(None)):
+        """
+        Calculates chem shift intensities for store rows `rows`, at titration step(s) `steps`.
+        Returns a (step x residue) array, with step and residue axes dropped for scalar arguments.
+        """
+        # select steps first : a step of a step major store is a contiguous block
+        chemshifts = self.store.chemshifts
+        reference = chemshifts[:, self.reference][rows]
+        stepChemshifts = chemshifts[:, steps][rows]
+        if stepChemshifts.ndim > reference.ndim:
+            reference = reference[..., np.newaxis, :]
+        delta = stepChemshifts - reference
+        return np.sqrt(np.sum((delta * self.weights)**2, axis=-1)).T
+
+    def row_intensities(self, row):
+        "Chem shift intensities of store row `row` at each step, read from cached matrix if any"
+        if self._intensityMatrix is not None:
+            return self._intensityMatrix[:, row]
+        return self.calculate_intensities(rows=row)
+
+    def intensity_index(self, step=-1):
+        """
+        Returns sorted index of complete residues intensities at titration step `step`,
+        as (intensities, indices) arrays : `intensities` in ascending order,
+        and `indices` their matching indices in complete residues.
+        Built on first query of each step, and cached along with intensities.
+        """
+        step = step if step >= 0 else self.dataSteps + step
+        if not 0 <= step < self.dataSteps:
+            raise IndexError("Step {step} does not exist".format(step=step))
+        index = self._intensityIndex.get(step)
+        if index is None:
+            if self._intensities is not None:
+                stepIntensities = self._intensities[step]
+            else: # only queried step is needed
+                stepIntensities = self.calculate_intensities(step, self.completeRows)
+            order = np.argsort(stepIntensities, kind='mergesort')
+            index = self._intensityIndex[step] = (stepIntensities[order], order)
+        return index
+
+    def indices_between(self, low=None, high=None, step=-1):
+        """
+        Returns sorted indices in complete residues of residues having intensity
+        within [`low`, `high`] at titration step `step`. Missing bounds are ignored.
+        Found by binary search in sorted intensity index.
+        """
+        if not self.dataSteps:
+            return np.zeros(0, dtype=int)
+        intensities, order = self.intensity_index(step)
+        start = 0 if low is None else np.searchsorted(intensities, low, side='left')
+        stop = len(intensities) if high is None else np.searchsorted(intensities, high, side='right')
+        return np.sort(order[start:stop])
+
+    def residues_between(self, low=None, high=None, step=-1):
+        """
+        Returns {position: AminoAcid} mapping of complete residues having intensity
+        within [`low`, `high`] at titration step `step`, in complete residues order.
+        """
+        rows = self.completeRows[self.indices_between(low, high, step)]
+        return ResidueDict(self.complete.__getitem__, self.store.positions[rows].tolist())
+
+    def fit_binding(self, positions=None):
+        """
+        Fits titration curves of complete residues at `positions` to a single binding site model,
+        accounting for ligand depletion, see fitting module.
+        Defaults to selected residues, or filtered residues if none is selected.
+        Residues are fitted at once as arrays, by chunks fitted in parallel processes.
+        Returns results as a DataFrame indexed by position, kept as `bindingFit` until data changes.
+        """
+        positions, intensities, titrant, analyte = self.fit_data(positions)
+        chunks = [intensities[start:start + self.FIT_CHUNK]
+                for start in range(0, max(len(intensities), 1), self.FIT_CHUNK)]
+        arguments = (chunks, repeat(titrant), repeat(analyte), repeat(self.reference))
+        if len(chunks) > 1 and self.FIT_WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=min(self.FIT_WORKERS, len(chunks))) as executor:
+                fits = list(executor.map(fitting.fit_curves, *arguments))
+        else:
+            fits = list(map(fitting.fit_curves, *arguments))
+
+        pd = import_pandas()
+        self.bindingReplicates = None
+        self.bindingFit = pd.DataFrame(
+            dict((column, np.concatenate([fit[column] for fit in fits])) for column in self.FIT_COLUMNS),
+            index=pd.Index(positions, name='Position'), columns=self.FIT_COLUMNS)
+        return self.bindingFit
+
+    def fit_global(self, positions=None):
+        """
+        Fits titration curves of complete residues at `positions` to a single binding site model,
+        with a Kd shared by all residues, see fitting.fit_global().
+        Defaults to selected residues, or filtered residues if none is selected.
+        Returns results as a DataFrame indexed by position, kept as `bindingFit` until data changes :
+        shared Kd and its standard error are repeated on each row, along with residue residuals,
+        and outlier flags for residues which may be excluded from fit.
+        """
+        positions, intensities, titrant, analyte = self.fit_data(positions)
+        fit = fitting.fit_global(intensities, titrant, analyte, self.reference)
+        pd = import_pandas()
+        self.bindingReplicates = None
+        self.bindingFit = pd.DataFrame(
+            dict((column, np.broadcast_to(fit[column], (len(positions),))) for column in self.GLOBAL_FIT_COLUMNS),
+            index=pd.Index(positions, name='Position'), columns=self.GLOBAL_FIT_COLUMNS)
+        return self.bindingFit
+
+    def fit_data(self, positions=None):
+        """
+        Returns (positions, intensities, titrant, analyte) fitted by binding fits, i.e. positions list,
+        (residue x step) intensities, and concentrations at each step.
+        `positions` defaults to selected residues, or filtered residues if none is selected.
+        Raises ValueError if titration protocole is not set or residues are not complete.
+        """
+        if positions is None:
+            positions = self.selected or self.filtered
+        positions = list(positions)
+        if not self.isInit:
+            raise ValueError("Titration parameters are not set, cannot fit binding curves.")
+        if self.steps < self.dataSteps:
+            raise ValueError("Protocole describes {steps} steps, {dataSteps} are needed to fit binding curves.".format(
+                steps=self.steps, dataSteps=self.dataSteps))
+        incomplete = [pos for pos in positions if pos not in self.complete]
+        if incomplete:
+            raise ValueError("Cannot fit binding curves of incomplete residues : {positions}".format(
+                positions=' '.join(map(str, incomplete))))
+
+        titrant, analyte = (concentrations[:self.dataSteps] for concentrations in self.concentrations)
+        intensities = self.intensityMatrix[:, self.store.find_rows(np.array(positions, dtype=int))].T
+        return positions, intensities, titrant, analyte
+
+    def bootstrap_fit(self, replicates=1000, method='residual', seed=0, level=0.95):
+        """
+        Estimates confidence intervals of current binding fit, see fit_binding() and fit_global(),
+        by fitting `replicates` of fitted curves perturbed with resampled residuals or gaussian noise,
+        see fitting.resample() for accepted methods.
+        Replicates are fitted by batches, spread over a process pool. Each batch is seeded from `seed`
+        and its index, so that results only depend on `seed`.
+        Adds KdLow and KdHigh columns to `bindingFit`, bounding Kd at confidence `level`,
+        and keeps replicates fitted parameters as `bindingReplicates`.
+        """
+        if self.bindingFit is None:
+            raise ValueError("No binding fit to estimate confidence intervals for, see fit command.")
+        if method not in fitting.RESAMPLING_METHODS:
+            raise ValueError("Unknown resampling method {method} : accepted are {methods}".format(
+                method=method, methods=', '.join(fitting.RESAMPLING_METHODS)))
+        fit = self.bindingFit
+        shared = 'KdError' in fit.columns # global fit
+        positions, intensities, titrant, analyte = self.fit_data(fit.index)
+        basis = fitting.model_basis(fit['Kd'].values[:, np.newaxis], titrant, analyte, self.reference)
+        # residues without chem shift variation have undetermined Kd
+        fitted = np.nan_to_num(fit['deltaMax'].values[:, np.newaxis] * basis)
+
+        batchSize = max(1, self.BOOTSTRAP_CURVES // max(len(positions), 1))
+        batches = [min(batchSize, replicates - start) for start in range(0, replicates, batchSize)]
+        arguments = (repeat(fitted), repeat(intensities - fitted), repeat(titrant), repeat(analyte),
+                    repeat(self.reference), batches, repeat(method), ([seed, index] for index in range(len(batches))),
+                    repeat(shared))
+        if len(batches) > 1 and self.FIT_WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=min(self.FIT_WORKERS, len(batches))) as executor:
+                results = list(executor.map(fitting.bootstrap_batch, *arguments))
+        else:
+            results = list(map(fitting.bootstrap_batch, *arguments))
+
+        self.bindingReplicates = dict((key, np.concatenate([result[key] for result in results]))
+                                    for key in ("Kd", "deltaMax"))
+        self.bindingReplicates["level"] = level
+        with np.errstate(invalid='ignore'):
+            bounds = np.nanpercentile(self.bindingReplicates["Kd"], [50 * (1 - level), 50 * (1 + level)], axis=0)
+        fit['KdLow'], fit['KdHigh'] = bounds
+        return fit
+
+    def binding_curve(self, position, points=100):
+        """
+        Returns ([titrant]/[analyte] ratios, intensities) arrays of fitted binding curve for residue at `position`,
+        sampled at `points` titrant volumes up to last step. Returns None if residue was not fitted.
+        """
+        if self.bindingFit is None or position not in self.bindingFit.index:
+            return None
+        fit = self.bindingFit.loc[position]
+        ratios, basis = self.binding_basis(fit['Kd'], points)
+        return ratios, fit['deltaMax'] * basis
+
+    def binding_band(self, position, points=100):
+        """
+        Returns ([titrant]/[analyte] ratios, low, high) arrays bounding fitted binding curve for residue at `position`
+        at bootstrap confidence level, see bootstrap_fit(). Returns None if residue was not bootstrapped.
+        """
+        if self.bindingReplicates is None or position not in self.bindingFit.index:
+            return None
+        index = self.bindingFit.index.get_loc(position)
+        kd, deltaMax = self.bindingReplicates["Kd"], self.bindingReplicates["deltaMax"][:, index]
+        kd = kd[:, index] if kd.ndim > 1 else kd
+        ratios, basis = self.binding_basis(kd[:, np.newaxis], points)
+        level = self.bindingReplicates["level"]
+        with np.errstate(invalid='ignore'):
+            low, high = np.nanpercentile(deltaMax[:, np.newaxis] * basis,
+                                        [50 * (1 - level), 50 * (1 + level)], axis=0)
+        return ratios, low, high
+
+    def binding_basis(self, kd, points=100):
+        """
+        Returns ([titrant]/[analyte] ratios, model intensities for deltaMax = 1) of binding model for `kd`,
+        sampled at `points` titrant volumes up to last step. See fitting.model_basis().
+        """
+        titrantVolume = np.linspace(0, sum(self.volumes[:self.dataSteps]), points)
+        titrant = titrantVolume * self.titrant['concentration'] / (self.startVol + titrantVolume)
+        analyte = self.analyteStartVol * self.analyte['concentration'] / (self.startVol + titrantVolume)
+        # reference step titrant concentration is inserted first, so that it may be used as model reference
+        referenceTitrant, referenceAnalyte = (concentrations[self.reference] for concentrations in self.concentrations)
+        basis = fitting.model_basis(kd, np.concatenate(([referenceTitrant], titrant)),
+                                    np.concatenate(([referenceAnalyte], analyte)))[..., 1:]
+        return titrant / analyte, basis
+
     def validate_filepath(self, filePath, verifyStep=False):
         """
         Given a file path, checks if it has `.list` extension and if it is numbered after the titration step.
@@ -454,20 +864,138 @@ class Titration(BaseTitration):
     def parse_titration_file(self, stream):
         """
         Titration file parser.
-        Returns a new dict which keys are residues' position and values are AminoAcid objects.
-        If residues argument is provided, updates AminoAcid by adding parsed chemical shift values.
+        Returns a new dict with keys position, chemshiftH and chemshiftN,
+        which values are arrays of parsed data, one element per residue.
+        Whole file is tokenized at once, lines are parsed one by one only if bulk parsing fails.
+        If a parse cache is set and `stream` is a file, cached content is reused when up to date.
         Throws ValueError if incorrect lines are encountered in file.
         """
-        for lineNb, line in enumerate(stream) :
+        content = stream.read()
+        metrics = self.metrics
+        # characters count, i.e. bytes for ASCII titration files
+        metrics.count('bytesRead', len(content))
+        path = getattr(stream, 'name', None)
+        cacheKey = None
+        if self.parseCache is not None and isinstance(path, str) and os.path.isfile(path):
+            cacheKey = self.parseCache.make_key(path, content)
+            chemshifts = self.parseCache.get(cacheKey)
+            if chemshifts is not None:
+                metrics.count('parseCacheHits')
+                return chemshifts
+            metrics.count('parseCacheMisses')
+
+        with metrics.time('parse'):
+            chemshifts = self.tokenize_titration_file(content)
+            if chemshifts is None:
+                chemshifts = self.parse_titration_lines(content.split('\n'))
+        if metrics.enabled:
+            metrics.count('bytesParsed', len(content))
+            metrics.count('linesParsed', content.count('\n') + 1)
+        if cacheKey is not None:
+            self.parseCache.put(cacheKey, chemshifts)
+        return chemshifts
+
+    def parse_titration_lines(self, lines):
+        """
+        Line by line titration file parser, reporting incorrect lines with their number.
+        Returns a dict of arrays as parse_titration_file does.
+        """
+        parsed = {"position": [], "chemshiftH": [], "chemshiftN": []}
+        for lineNb, line in enumerate(lines) :
             try:
                 chemshifts = self.parse_line(line)
                 if chemshifts is not None:
-                    self.add_chemshifts(chemshifts)
+                    for key, values in parsed.items():
+                        values.append(chemshifts[key])
             except ValueError as parseError:
                 parseError.args = ("{error} at line {line}".format(
                     error=parseError, line=lineNb), )
                 raise
-                continue
+        return {
+            "position": np.array(parsed["position"], dtype=int),
+            "chemshiftH": np.array(parsed["chemshiftH"], dtype=float),
+            "chemshiftN": np.array(parsed["chemshiftN"], dtype=float)
+        }
+
+    @classmethod
+    def tokenize_titration_file(cls, content):
+        """
+        Bulk titration file parser, working on the whole file content as an array of characters.
+        Lines are handled the same as parse_line does : lines starting with a digit must
+        match LINE_PATTERN, other lines are ignored.
+        Returns a dict of arrays as parse_titration_file does,
+        or None if content cannot be parsed this way (non ASCII content, invalid lines, ...).
+        """
+        try:
+            chars = np.frombuffer(content.encode('ascii'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            return None
+        # only allow control characters matched by \s
+        if ((chars < 9) | ((chars > 13) & (chars < 28)) | (chars == 127)).any():
+            return None
+        # tokens are runs of non space characters, as [start, end) intervals
+        isSpace = np.concatenate(([True], chars <= ord(' '), [True]))
+        bounds = np.flatnonzero(isSpace[1:] != isSpace[:-1])
+        starts, ends = bounds[::2], bounds[1::2]
+        # first token of each line
+        tokenLines = np.searchsorted(np.flatnonzero(chars == ord('\n')), starts)
+        firsts = np.flatnonzero(np.concatenate(([True], tokenLines[1:] != tokenLines[:-1])))[:len(starts)]
+        lineTokens = np.diff(np.append(firsts, len(starts)))
+        # data lines start with a digit, and must contain exactly 3 tokens
+        firstChars = chars[starts[firsts]]
+        parsed = (firstChars >= ord('0')) & (firstChars <= ord('9'))
+        if (lineTokens[parsed] != 3).any():
+            return None
+        positionTokens = firsts[parsed]
+        if not len(positionTokens):
+            return {"position": np.zeros(0, dtype=int), "chemshiftN": np.zeros(0), "chemshiftH": np.zeros(0)}
+
+        # fixed width windows over space padded characters :
+        # windows[i + width] starts at character i, windows[i] ends before character i
+        width = cls.TOKEN_WIDTH
+        padding = np.full(width, ord(' '), dtype=np.uint8)
+        padded = np.concatenate((padding, chars, padding))
+        windows = np.lib.stride_tricks.as_strided(padded, shape=(len(chars) + width, width), strides=(1, 1))
+        # weighted sums are done as float dot products, exact as long as values are below 2**53
+        powers = 10.0**np.arange(width - 1, -1, -1)
+
+        # positions are the leading digits of first token, followed by a non digit character
+        # within the window, i.e up to width - 1 digits
+        positionChars = windows[starts[positionTokens] + width]
+        positionDigits = (positionChars >= ord('0')) & (positionChars <= ord('9'))
+        digitCount = np.argmin(positionDigits, axis=1)
+        if (digitCount == 0).any():
+            return None
+        leading = np.arange(width) < digitCount[:, np.newaxis]
+        positions = ((positionChars - float(ord('0'))) * leading).dot(powers).astype(np.int64) \
+                    // 10**(width - digitCount)
+
+        # chem shifts are formatted as \d+\.\d+, read as right aligned windows
+        shiftTokens = np.concatenate((positionTokens + 1, positionTokens + 2))
+        shiftLengths = ends[shiftTokens] - starts[shiftTokens]
+        if shiftLengths.max() > width:
+            return None
+        shiftChars = windows[ends[shiftTokens]]
+        inShift = np.arange(width) >= width - shiftLengths[:, np.newaxis]
+        shiftDigits = (shiftChars >= ord('0')) & (shiftChars <= ord('9')) & inShift
+        shiftDots = (shiftChars == ord('.')) & inShift
+        ones = np.ones(width)
+        if not ((shiftDigits.dot(ones) == shiftLengths - 1).all()
+                and (shiftDots.dot(ones) == 1).all()
+                and shiftDigits[:, -1].all()
+                and shiftDigits[np.arange(len(shiftLengths)), width - shiftLengths].all()):
+            return None
+        # dot is read as a 0 digit and removed from integer mantissa
+        # conversion is exact, as a mantissa below 2**53 divided by a power of ten is correctly rounded
+        decimals = width - 1 - np.argmax(shiftDots, axis=1)
+        digitValues = ((shiftChars - float(ord('0'))) * shiftDigits).dot(powers).astype(np.int64)
+        mantissas = digitValues // 10**(decimals + 1) * 10**decimals + digitValues % 10**decimals
+        shifts = (mantissas / 10.0**decimals).reshape(2, -1)
+        return {
+            "position": positions.astype(int),
+            "chemshiftN": shifts[0],
+            "chemshiftH": shifts[1]
+        }
 
     def parse_line(self, line):
         "Parses a line from titration file, returning a dictionnaryof parsed data"
@@ -477,26 +1005,33 @@ class Titration(BaseTitration):
             # attempt to match to expected format
             match = self.LINE_PATTERN.match(line)
             if match: # parse as dict
-                chemshifts = match.groupdict()
-                # Convert parsed str to number types
-                for castFunc, key in zip((float, float, int), sorted(chemshifts)):
-                    chemshifts[key] = castFunc(chemshifts[key])
-                # add or update residue
-                return chemshifts
+                return {
+                    "position": int(match.group("position")),
+                    "chemshiftH": float(match.group("chemshiftH")),
+                    "chemshiftN": float(match.group("chemshiftN"))
+                }
             else:
                 # non parsable, non ignorable line
                 raise ValueError("Found unparsable line")
 
     def add_chemshifts(self, chemshifts):
-        "Arg chemshifts is a dict with keys position, chemshiftH, chemshiftN"
-        position = chemshifts["position"]
-        if self.residues.get(position):
-            # update AminoAcid object in residues dict
-            self.residues[position].add_chemshifts(**chemshifts)
-        else:
-            # create AminoAcid object in residues dict
-            self.residues[position] = AminoAcid(**chemshifts)
-        return self.residues[position]
+        """
+        Arg chemshifts is a dict with keys position, chemshiftH, chemshiftN,
+        either as scalars or arrays. Values are set in store for last titration step.
+        Returns list of positions added to residues.
+        """
+        knownRows = len(self.store)
+        self.store.set_chemshifts(self.store.steps - 1, chemshifts["position"],
+                                chemshifts["chemshiftH"], chemshifts["chemshiftN"])
+        # add residues for new positions, AminoAcid objects are created on first access
+        newPositions = [position for position in self.store.positions[knownRows:].tolist()
+                        if position not in self.residues]
+        self.residues.add(newPositions)
+        return newPositions
+
+    def make_residue(self, position):
+        "Returns a new AminoAcid object bound to titration, at `position`"
+        return AminoAcid(position=position, titration=self)
 
 
 
@@ -520,7 +1055,7 @@ class Titration(BaseTitration):
         "Deselect some residues. Calling with no arguments will deselect all."
         try:
             if not positions:
-                self.selected = dict()
+                self.selected.clear()
             else:
                 for pos in positions:
                     self.selected.pop(pos)
@@ -533,14 +1068,76 @@ class Titration(BaseTitration):
 ##    Properties
 ## --------------------------
 
+    @property
+    def intensityMatrix(self):
+        """
+        (step x residue) array of chem shift intensities, for each row in store.
+        Intensity is NaN if chem shift data is missing.
+        Calculated at once for all residues, and cached until data, reference or weights change.
+        """
+        if self._intensityMatrix is None:
+            with self.metrics.time('intensities'):
+                intensities = self.calculate_intensities()
+                steps, size = intensities.shape
+                # matrix is a view onto a buffer, grown by extend_intensities() when steps are added
+                buffer = np.empty((steps, size))
+                buffer[:] = intensities
+                self._intensityMatrix = buffer[:steps]
+        return self._intensityMatrix
+
+    @property
+    def intensities(self):
+        "(step x residue) array of chem shift intensities for complete residues"
+        if self._intensities is None:
+            self._intensities = self.intensityMatrix[:, self.completeRows]
+        return self._intensities
+
+    @property
+    def job_attributes(self):
+        "Titration attributes saved in job files, as a JSON serializable dict"
+        attributes = dict([(attribute, getattr(self, attribute)) for attribute in self.JOB_ATTRIBUTES])
+        attributes["cutoff"] = float(self.cutoff) if self.cutoff is not None else None
+        attributes["weights"] = list(self.weights)
+        return attributes
+
+    @property
+    def job_arrays(self):
+        """
+        Titration data saved in job files, as a dict of arrays.
+        Chem shifts are saved step major, so that reading a single step from a mapped file is cheap.
+        """
+        return {
+            "positions": self.store.positions,
+            "residues": np.array(list(self.residues), dtype=int),
+            "stepChemshifts": self.store.chemshifts.transpose(1, 0, 2),
+            "stepMissing": self.store.missing.transpose(1, 0, 2),
+            "complete": np.array(list(self.complete), dtype=int),
+            "incomplete": np.array(list(self.incomplete), dtype=int),
+            "selected": np.array(list(self.selected), dtype=int),
+            "volumes": np.array(self.volumes, dtype=float)
+        }
+
     @property
     def filtered(self):
-        "Returns list of filtered residue having last intensity >= cutoff value"
-        if self.cutoff is not None:
-            return dict([(res.position, res) for res in self.complete.values() if res.chemshiftIntensity[-1] >= self.cutoff])
+        "Returns {position: AminoAcid} mapping of filtered residues, having last intensity >= cutoff value"
+        if self.cutoff is not None and self.dataSteps:
+            return self.residues_between(low=self.cutoff)
         else:
             return dict()
 
+    @property
+    def stats(self):
+        """
+        Dict of collected metrics, see classes.metrics : counters, then calls and seconds of each timer,
+        followed by parsing rates.
+        """
+        stats = self.metrics.as_dict()
+        parseSeconds = self.metrics.seconds('parse')
+        if parseSeconds:
+            stats['linesPerSecond'] = stats.get('linesParsed', 0) / parseSeconds
+            stats['bytesPerSecond'] = stats.get('bytesParsed', 0) / parseSeconds
+        return stats
+
     @property
     def sortedSteps(self):
         """
@@ -556,29 +1153,49 @@ class Titration(BaseTitration):
 
 class TitrationCLI(Titration):
 
-    def __init__(self, working_directory, name=None, cutoff=None, initFile=None, **kwargs):
+    # number of threads reading and parsing titration files
+    LOAD_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+    # stale hists key of heatmap, see add_watched_steps()
+    HEATMAP = 'heatmap'
+    # watched steps with less residues than this ratio of previous steps median are rejected
+    WATCH_MIN_RESIDUES = 0.8
 
-        if not os.path.isdir(working_directory):
-            raise IOError("{dir} does not exist")
+    def __init__(self, working_directory=None, name=None, cutoff=None, initFile=None, jobFile=None, **kwargs):
+        """
+        Loads titration from `working_directory`,
+        or from saved job file `jobFile` if provided.
+        """
+        if jobFile is None and not (os.path.isdir(working_directory) or archives.is_archive(working_directory)):
+            raise IOError("{dir} does not exist".format(dir=working_directory))
             exit(1)
 
         self.dirPath = working_directory
 
         Titration.__init__(self, name=name, **kwargs)
+        self.parseCache = ParseCache()
+
+        # background loading of new steps, see watch()
+        self.lock = threading.RLock()
+        self.watcher = None
 
         # init plots
         self.stackedHist = None
+        self.heatmap = None
         self.hist = dict()
+        self.staleHists = set() # steps of hists to plot again, None for stacked hist, HEATMAP for heatmap
         ## FILE PATH PROCESSING
         # fetch all .list files in source dir, parse
         # add a step for each file
-        try:
-            self.update()
-        except IOError as error:
-            print("{error}".format(error=error), file=sys.stderr)
-            exit(1)
-
-        initFile = initFile or self.extract_init_file(self.dirPath)
+        if jobFile is not None:
+            if self.load(jobFile) is None:
+                exit(1)
+        else:
+            try:
+                self.update()
+            except IOError as error:
+                print("{error}".format(error=error), file=sys.stderr)
+                exit(1)
+            initFile = initFile or self.extract_init_file(self.dirPath)
 
         if initFile: self.load_init_path(initFile)
 
@@ -586,17 +1203,24 @@ class TitrationCLI(Titration):
             self.set_cutoff(cutoff)
 
 
-    def add_step(self, titrationFilePath, volume=None):
+    def add_step(self, titrationFilePath, volume=None, parsed=None):
+        """
+        Adds titration file as next step.
+        If `parsed` is provided, it is a future holding file content parsed beforehand, see update()
+        """
         try:
-            with open(titrationFilePath, 'r') as titrationStream:
-                Titration.add_step(self, titrationFilePath, titrationStream, volume=volume)
-
-            # generate colors for each titration step
-            self.colors = plt.cm.get_cmap('hsv', self.dataSteps)
+            if parsed is not None:
+                Titration.add_step(self, titrationFilePath, None, volume=volume, parsed=parsed)
+            else:
+                with archives.open_titration_file(titrationFilePath) as titrationStream:
+                    Titration.add_step(self, titrationFilePath, titrationStream, volume=volume)
 
-            # close stale stacked hist
+            # flag open stacked hist and heatmap as stale, figures are only plotted again
+            # from main thread by refresh_hists(), as steps may be added by watcher thread
             if self.stackedHist and not self.stackedHist.closed:
-                self.stackedHist.close()
+                self.staleHists.add(None)
+            if self.heatmap and not self.heatmap.closed:
+                self.staleHists.add(self.HEATMAP)
 
         except IOError as fileError:
             print("{error}".format(error=fileError), file=sys.stderr)
@@ -614,12 +1238,66 @@ class TitrationCLI(Titration):
                 hist.set_cutoff(cutoff)
             if self.stackedHist:
                 self.stackedHist.set_cutoff(cutoff)
+            if self.heatmap:
+                self.heatmap.set_cutoff(cutoff)
             return self.cutoff
         except TypeError as err:
             print("Invalid cut-off value : {error}".format(
                 error=err), file=sys.stderr)
             return self.cutoff
 
+    def watch(self, interval=1.0, settle=2.0):
+        """
+        Starts watching source directory in background, adding new titration steps
+        as soon as their files are completely written. See StepWatcher.
+        Returns None if source is not a directory.
+        """
+        if not os.path.isdir(self.dirPath):
+            print("Cannot watch {source} : not a directory".format(source=self.dirPath), file=sys.stderr)
+            return
+        if self.watcher is None or not self.watcher.is_alive():
+            self.watcher = StepWatcher(self, self.add_watched_steps, interval=interval, settle=settle)
+            self.watcher.start()
+        return self.watcher
+
+    def unwatch(self):
+        "Stops watching source directory"
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def add_watched_steps(self, files):
+        """
+        Adds step files found by watcher, flagging open histograms as stale.
+        They are plotted again by refresh_hists(), as matplotlib figures
+        may only be updated from main thread.
+        Steps with far less residues than previous ones are rejected, as their file may be partially written.
+        """
+        with self.lock:
+            completeCount = len(self.complete)
+            openHists = [step for step, hist in self.hist.items() if not hist.closed]
+            minResidues = None
+            if self.dataSteps:
+                stepResidues = (~self.store.missing.all(axis=2)).sum(axis=0)
+                minResidues = self.WATCH_MIN_RESIDUES * np.median(stepResidues)
+            # stacked hist and heatmap are flagged by add_step()
+            files = self.update(files, minResidues=minResidues)
+            # step hists only change along with complete residues
+            if files and len(self.complete) != completeCount:
+                self.staleHists.update(openHists)
+        return files
+
+    def refresh_hists(self):
+        "Plots again histograms flagged as stale, see add_watched_steps()"
+        with self.lock:
+            staleHists, self.staleHists = self.staleHists, set()
+            for step in staleHists:
+                if step == self.HEATMAP:
+                    self.plot_heatmap()
+                else:
+                    self.plot_hist(step)
+
+
 ## -------------------------
 ##    Utils
 ## -------------------------
@@ -637,33 +1315,64 @@ class TitrationCLI(Titration):
                 self.load_init_file(initStream)
 
         files = set(glob.glob(os.path.join(extract_dir, '*.list')))
+        files.update(glob.glob(os.path.join(extract_dir, '*.list.gz')))
         if len(files) < 1:
             raise ValueError("Directory {dir} does not contain any `.list` titration file.".format(
                 dir=extract_dir))
         return files
 
+    def extract_archive(self, archivePath):
+        "Lists titration files in archive, or directory within archive, loading init file found along, see classes.archives"
+        files = set(archives.list_titration_files(archivePath))
+        if len(files) < 1:
+            raise ValueError("Archive {archive} does not contain any `.list` titration file.".format(
+                archive=archivePath))
+
+        # update protocole if init file is present next to titration files
+        directory = os.path.dirname(min(files))
+        initFiles = archives.list_init_files(directory)
+        if initFiles:
+            initFile = initFiles[0]
+            if len(initFiles) > 1:
+                print("{number} init files found in {source}. Using first one : {file}".format(
+                                    number=len(initFiles), source=directory, file=initFile),
+                                    file=sys.stderr)
+            self.load_init_file(io.StringIO(archives.read_files([initFile])[initFile]))
+        return files
+
     def extract_source(self, source=None):
         """
-        Handles source data depending on type (file list, directory, saved file).
+        Handles source data depending on type (file list, directory, archive).
+        Lists may mix titration files, directories and archives.
+        Files within archives are named after archive path, followed by their name in archive.
         """
         source = source or self.dirPath
         # extract list of files
-        if type(source) is list:
-            if len(source) <= 1:
-                if os.path.isdir(source[0]):
-                    files = self.extract_dir(source.pop())
-            for file in source:
-                if not os.path.isfile(file):
-                    raise IOError("{path} is not a file.".format(path=file))
-                    return
-            files = set(map(os.path.abspath, source))
-        elif os.path.isdir(source):
-            files=self.extract_dir(source)
-        else:
-            files = set(source)
+        if type(source) is not list:
+            source = [source]
+        files = set()
+        for path in source:
+            if os.path.isdir(path):
+                files.update(self.extract_dir(path))
+            elif archives.is_archive(path):
+                # archive itself, directory or file within archive
+                archivePath, member = archives.split_path(path)
+                if member.lower().endswith(archives.TITRATION_EXTENSIONS):
+                    files.add(path)
+                else:
+                    files.update(self.extract_archive(path))
+            elif os.path.isfile(path):
+                files.add(os.path.abspath(path))
+            else:
+                raise IOError("{path} is not a file.".format(path=path))
         return files
 
-    def update(self, source=None):
+    def update(self, source=None, minResidues=None):
+        """
+        Adds new titration files from `source` as next steps, see extract_source().
+        If `minResidues` is set, files with less residues stop update, as well as following files.
+        Returns added files.
+        """
         files = self.extract_source(source)
 
         # exclude already known files
@@ -676,46 +1385,78 @@ class TitrationCLI(Titration):
             raise
             return
 
-        # load files
-        for file in files:
-            self.add_step(file)
+        # archive members are read beforehand, as compressed archives can only be read sequentially
+        contents = archives.read_files([file for file in files if archives.is_archive(file)])
+
+        # read and parse files concurrently, then add them in step order
+        with ThreadPoolExecutor(max_workers=self.LOAD_WORKERS) as executor:
+            parsed = [executor.submit(self.read_titration_file, file, contents.pop(file, None)) for file in files]
+            for index, (file, future) in enumerate(zip(files, parsed)):
+                if minResidues and future.exception() is None and len(future.result()["position"]) < minResidues:
+                    print("Skipping {file} : {count} residues only, file may be partially written.".format(
+                        file=file, count=len(future.result()["position"])), file=sys.stderr)
+                    files = files[:index]
+                    break
+                self.add_step(file, parsed=future)
+        self.parseCache.evict()
 
         return files
 
-    def save(self, path):
-        "Save method for titration object"
+    def read_titration_file(self, titrationFilePath, content=None):
+        """
+        Reads and parses titration file at `titrationFilePath`.
+        If file `content` is provided, it is parsed instead of reading file.
+        """
+        if content is not None:
+            titrationStream = io.StringIO(content)
+            titrationStream.name = titrationFilePath
+        else:
+            titrationStream = archives.open_titration_file(titrationFilePath)
+        with titrationStream:
+            return self.parse_titration_file(titrationStream)
+
+    def save(self, path, compression=None):
+        """
+        Saves titration to job file at `path`, see classes.job module.
+        `compression` may be None, 'zlib', 'lzma' or 'bz2'.
+        """
         try:
-            # matplotlib objects can't be saved
-            stackedHist = self.stackedHist
-            hist = self.hist
-            self.stackedHist= None
-            self.hist = dict()
-            with open(path, 'wb') as saveHandle:
-                pickle.dump(self, saveHandle)
-            # restore matplotlib objects
-            self.stackedHist = stackedHist
-            self.hist = hist
-        except IOError as fileError:
+            attributes = self.job_attributes
+            attributes["dirPath"] = self.dirPath
+            # data loaded from the job file being overwritten is read beforehand
+            mappedFiles = set(job.mapped_file(array) for array in
+                            (self.store.positions, self.store.chemshifts, self.store.missing))
+            if os.path.realpath(path) in set(os.path.realpath(mapped) for mapped in mappedFiles if mapped):
+                self.store.copy_arrays()
+            return job.write_job(path, attributes, self.job_arrays, compression=compression)
+        except (ValueError, IOError) as fileError:
             print("Could not save titration : {error}\n".format(error=fileError), file=sys.stderr)
 
     def load(self, path):
         "Loads previously saved titration in place of current instance"
         try:
-            with open(path, 'rb') as loadHandle:
-                self = pickle.load(loadHandle)
-                if type(self) == Titration:
-                    return self
-                else:
-                    raise ValueError("{file} does not contain a Titration object".format(file=path))
+            attributes, arrays = job.read_job(path)
+            self.restore_job(attributes, arrays)
         except (ValueError, IOError) as loadError:
             print("Could not load titration : {error}\n".format(error=loadError), file=sys.stderr)
+            return
+        self.dirPath = attributes.get("dirPath", self.dirPath)
+        # drop plots of previous titration
+        self.stackedHist = None
+        self.heatmap = None
+        self.hist = dict()
+        self.staleHists = set()
+        return self
 
 ## -------------------------------------------
 ##      Properties
 ## -------------------------------------------
     @property
-    def concentrationRatio(self):
-    	return [value for value in self.protocole['[titrant]/[analyte]']]
+    def colors(self):
+        "Colormap holding a color for each titration step"
+        from matplotlib import cm
+        return cm.get_cmap('hsv', self.dataSteps)
+
     @property
     def summary(self):
         "Returns a short summary of current titration status as string."
@@ -747,7 +1488,9 @@ class TitrationCLI(Titration):
             if self.stackedHist and not self.stackedHist.closed:
                 self.stackedHist.close()
             # replace stacked hist with new hist
-            hist = MultiHist(self.complete,self.intensities[1:])
+            from classes.plots import MultiHist
+            with self.metrics.time('plotMultiHist'):
+                hist = MultiHist(self.complete,self.intensities[1:])
             self.stackedHist = hist
         else: # plot specific titration step
             # allow accession using python-ish negative index
@@ -756,7 +1499,9 @@ class TitrationCLI(Titration):
             if self.hist.get(step) and not self.hist[step].closed:
                 self.hist[step].close()
             # plot new hist
-            hist = Hist(self.complete, self.intensities[step], step=step)
+            from classes.plots import Hist
+            with self.metrics.time('plotHist'):
+                hist = Hist(self.complete, self.intensities[step], step=step)
             self.hist[step] = hist
         # add cutoff change event handling
         hist.add_cutoff_listener(self.set_cutoff, mouseUpdateOnly=True)
@@ -765,29 +1510,69 @@ class TitrationCLI(Titration):
         hist.set_cutoff(self.cutoff)
         return hist
 
+    def plot_heatmap(self, show=True):
+        """
+        Plots intensities of complete residues at all steps as a single heatmap image,
+        outlining intensities above cut off.
+        Unlike stacked histograms, figure stays readable and fast to draw for many steps.
+        """
+        if self.heatmap and not self.heatmap.closed:
+            self.heatmap.close()
+        from classes.plots import Heatmap
+        with self.metrics.time('plotHeatmap'):
+            self.heatmap = Heatmap(list(self.complete), self.intensities[1:], cutoff=self.cutoff)
+        if show:
+            self.heatmap.show()
+        return self.heatmap
+
 
-    def plot_shiftmap(self, residues, split = False):
+    def plot_shiftmap(self, residues, split = False, show=True, rasterized=None, page=0):
         """
         Plot measured chemical shifts for each residue as a scatter plot of (chemshiftH, chemshiftN).
         Each color is assigned to a titration step.
         `residue` argument should be an iterable of AminoAcid objects.
-        If using `split` option, each residue is plotted in its own subplot.
+        If using `split` option, each residue is plotted in its own subplot,
+        showing page `page` of residues, see SplitLayout.
+        If `rasterized` is set, chem shifts are rasterized in exported vector images,
+        which defaults to maps of many residues, see ShiftMap.
         """
+        from classes.plots import ShiftMap, SplitShiftMap
         residues = list(residues)
-        if split and len(residues) > 1:
-            shiftmap = SplitShiftMap(residues)
-        else: # Trace global chem shifts map
-            shiftmap = ShiftMap(residues)
-        shiftmap.show()
+        with self.metrics.time('plotShiftMap'):
+            if split and len(residues) > 1:
+                shiftmap = SplitShiftMap(residues, page=page, rasterized=rasterized)
+            else: # Trace global chem shifts map
+                shiftmap = ShiftMap(residues, rasterized=rasterized)
+        if show:
+            shiftmap.show()
         return shiftmap
 
+    def export_split_shiftmap(self, residues, path, rasterized=None):
+        """
+        Writes split shift map of `residues`, or of their SplitLayout, to `path`, with all its pages.
+        PDF files hold all pages as vector graphics, other formats get a file per page. Returns list of written files.
+        """
+        from classes.plots import export_split_shiftmap
+        with self.metrics.time('exportShiftMap'):
+            return export_split_shiftmap(residues, path, rasterized=rasterized, workers=self.PLOT_WORKERS)
 
-    def plot_titration(self, residue):
-        "Plots a titration curve for `residue`, using intensity at each step"
-        curve = TitrationCurve(self.concentrationRatio[:self.dataSteps], residue,
-                                titrant=self.titrant['name'],
-                                analyte=self.analyte['name'])
-        curve.show()
+
+    def plot_titration(self, residue, show=True):
+        """
+        Plots a titration curve for `residue`, using intensity at each step.
+        Fitted binding curve is shown as well if residue was fitted, along with its confidence band if bootstrapped.
+        """
+        from classes.plots import TitrationCurve
+        fit = None
+        if self.bindingFit is not None and residue.position in self.bindingFit.index:
+            fit = self.binding_curve(residue.position) + (self.bindingFit.loc[residue.position, 'Kd'],)
+        with self.metrics.time('plotCurve'):
+            curve = TitrationCurve(self.concentrationRatio[:self.dataSteps], residue,
+                                    titrant=self.titrant['name'],
+                                    analyte=self.analyte['name'],
+                                    fit=fit, band=self.binding_band(residue.position))
+        if show:
+            curve.show()
         return curve
 
 
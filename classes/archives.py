@@ -0,0 +1,131 @@
+""" Archives module
+
+Access to titration files stored in tar or zip archives, or compressed with gzip,
+without extracting them to disk.
+Files within an archive are designated by the archive path followed by the member name,
+like `data/listes.tar.gz/listes/listPP/15N_UIM-SH3-37_00.list`.
+"""
+
+import gzip
+import io
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+TITRATION_EXTENSIONS = ('.list', '.list.gz')
+INIT_EXTENSIONS = ('.yml', '.json')
+# archive extension ending a path component
+ARCHIVE_PATTERN = re.compile(r'(?:{extensions})(?=/|$)'.format(
+    extensions='|'.join(map(re.escape, ARCHIVE_EXTENSIONS))), re.IGNORECASE)
+
+def split_path(path):
+    """
+    Splits a path within an archive into (archive path, member name).
+    Member name is empty for archive itself, and may designate a directory within archive.
+    Returns None if path does not lead to an existing archive.
+    """
+    for matching in ARCHIVE_PATTERN.finditer(path):
+        archivePath = path[:matching.end()]
+        if os.path.isfile(archivePath):
+            return archivePath, path[matching.end():].strip('/')
+    return None
+
+def is_archive(path):
+    "Checks if `path` is an archive, or a directory within an archive"
+    return split_path(path) is not None
+
+def list_names(archivePath):
+    "Returns names of regular file members of archive"
+    if zipfile.is_zipfile(archivePath):
+        with zipfile.ZipFile(archivePath) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+    with tarfile.open(archivePath) as archive:
+        return [member.name for member in archive if member.isfile()]
+
+def list_titration_files(path):
+    """
+    Returns paths of titration files in archive directory `path`.
+    If `path` is an archive holding no titration file at its root,
+    its only directory containing titration files is used.
+    Raises ValueError if there are several such directories.
+    """
+    archivePath, directory = split_path(path)
+    series = dict() # {directory: titration file names}
+    for name in list_names(archivePath):
+        if name.lower().endswith(TITRATION_EXTENSIONS):
+            series.setdefault(posixpath.dirname(name.strip('/')), []).append(name)
+    if not directory and '' not in series and len(series) > 1:
+        raise ValueError("Archive {archive} contains several titrations, choose one among :\n{choices}".format(
+            archive=archivePath, choices='\n'.join(
+                posixpath.join(archivePath, seriesDir) for seriesDir in sorted(series))))
+    if not directory and '' not in series and series:
+        directory = next(iter(series))
+    return [posixpath.join(archivePath, name) for name in series.get(directory, [])]
+
+def list_init_files(path):
+    """
+    Returns paths of init files in archive directory `path`,
+    .yml files if any, .json files otherwise, like Titration.extract_init_file().
+    """
+    archivePath, directory = split_path(path)
+    initFiles = dict() # {extension: init file paths}
+    for name in sorted(list_names(archivePath)):
+        extension = posixpath.splitext(name)[1].lower()
+        if extension in INIT_EXTENSIONS and posixpath.dirname(name.strip('/')) == directory:
+            initFiles.setdefault(extension, []).append(posixpath.join(archivePath, name))
+    return initFiles.get('.yml') or initFiles.get('.json', [])
+
+def read_files(paths):
+    """
+    Returns {path: text content} for titration or init files at `paths`, which may be archive members.
+    Each archive is read once, in a single pass.
+    """
+    contents = dict()
+    members = dict() # {archive path: {member name: path}}
+    for path in paths:
+        archivePath, member = split_path(path) or (None, None)
+        if archivePath is None:
+            with open_titration_file(path) as stream:
+                contents[path] = stream.read()
+        else:
+            members.setdefault(archivePath, dict())[member] = path
+
+    for archivePath, names in members.items():
+        if zipfile.is_zipfile(archivePath):
+            with zipfile.ZipFile(archivePath) as archive:
+                archiveNames = set(archive.namelist())
+                for name, path in names.items():
+                    if name in archiveNames:
+                        contents[path] = decode(name, archive.read(name))
+        else:
+            with tarfile.open(archivePath) as archive:
+                for member in archive:
+                    if member.name in names:
+                        data = archive.extractfile(member).read()
+                        contents[names[member.name]] = decode(member.name, data)
+        missing = set(names.values()).difference(contents)
+        if missing:
+            raise IOError("{path} is not a file.".format(path=missing.pop()))
+    return contents
+
+def decode(name, data):
+    "Returns text content of titration file `name`, which raw content is `data`"
+    if name.lower().endswith('.gz'):
+        data = gzip.decompress(data)
+    return data.decode()
+
+def open_titration_file(path):
+    """
+    Opens titration file at `path` as a text stream named after `path`.
+    `path` may be a gzip compressed file, or an archive member.
+    """
+    if split_path(path) is not None:
+        stream = io.StringIO(read_files([path])[path])
+        stream.name = path
+        return stream
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
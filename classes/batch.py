@@ -0,0 +1,156 @@
+""" Batch module
+
+Unattended processing of titrations, without interactive shell.
+Each titration source (directory, archive or job file) is loaded and analysed in its own process,
+its results written to its own output directory :
+    - intensities.csv : chem shift intensities of complete residues at each step
+    - filtered.csv : residues above cutoff at last step, along with their last intensity
+    - protocole.csv and fit.csv : titration protocole and binding fit of filtered residues,
+      if protocole is set
+    - hist.png, shiftmap.png and curves/<position>.png figures, drawn with matplotlib Agg backend
+    - shift2me.log : loading messages
+A summary of all titrations is written to `summary.csv`, in output root directory.
+"""
+
+import contextlib
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from classes import archives
+from classes import job
+
+SUMMARY_FIELDS = ('source', 'output', 'name', 'steps', 'residues', 'complete', 'filtered', 'fitted', 'error')
+LOG_FILE = 'shift2me.log'
+
+def output_name(source):
+    "Output directory name of titration `source` : its base name, without archive or job extension"
+    name = os.path.basename(os.path.normpath(source))
+    name = archives.ARCHIVE_PATTERN.sub('', name)
+    if name.endswith(job.EXTENSION):
+        name = name[:-len(job.EXTENSION)]
+    return name or 'titration'
+
+def output_dirs(sources, root):
+    "Returns an output directory within `root` for each source, numbering sources sharing a name"
+    dirs, names = [], set()
+    for source in sources:
+        name, count = output_name(source), 1
+        while name in names:
+            count += 1
+            name = "{name}_{count}".format(name=output_name(source), count=count)
+        names.add(name)
+        dirs.append(os.path.join(root, name))
+    return dirs
+
+def load_titration(source, cutoff=None, initFile=None):
+    "Loads titration from directory or archive `source`, or from job file"
+    from classes.Titration import TitrationCLI
+    isJob = os.path.isfile(source) and not archives.is_archive(source)
+    return TitrationCLI(working_directory=None if isJob else source,
+                        jobFile=source if isJob else None,
+                        # saved jobs keep their own cutoff
+                        cutoff=cutoff or (None if isJob else 0.1),
+                        initFile=initFile)
+
+def process_titration(source, output, cutoff=None, initFile=None, fit=True, plots=True):
+    """
+    Loads titration `source` and writes its results to `output` directory.
+    Returns a summary dict, with SUMMARY_FIELDS keys. Errors are reported in its `error` field.
+    """
+    summary = dict.fromkeys(SUMMARY_FIELDS)
+    summary.update(source=source, output=output)
+    try:
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, LOG_FILE), 'w') as log, contextlib.redirect_stderr(log):
+            write_results(load_titration(source, cutoff, initFile), output, summary, fit=fit, plots=plots)
+    # titration loading exits on invalid sources
+    except (Exception, SystemExit) as error:
+        summary["error"] = "{kind} : {error}".format(kind=type(error).__name__, error=error)
+    return summary
+
+def write_results(titration, output, summary, fit=True, plots=True):
+    "Writes `titration` results to `output` directory, updating `summary` dict"
+    from classes.Titration import import_pandas
+    pd = import_pandas()
+    # titrations are processed in parallel, binding fits are not
+    titration.FIT_WORKERS = 1
+
+    filtered = list(titration.filtered)
+    summary.update(name=titration.name, steps=titration.dataSteps, residues=len(titration.residues),
+                complete=len(titration.complete), filtered=len(filtered), fitted=0)
+
+    intensities = pd.DataFrame(titration.intensities.T, index=pd.Index(list(titration.complete), name='Position'),
+                            columns=range(titration.dataSteps))
+    intensities.to_csv(os.path.join(output, 'intensities.csv'))
+    intensities.loc[filtered, intensities.columns[-1:]].to_csv(os.path.join(output, 'filtered.csv'))
+
+    if titration.isInit:
+        titration.protocole.to_csv(os.path.join(output, 'protocole.csv'))
+        if fit and filtered:
+            try:
+                titration.fit_binding(filtered).to_csv(os.path.join(output, 'fit.csv'))
+                summary["fitted"] = len(filtered)
+            except ValueError as error:
+                print(error, file=sys.stderr)
+
+    if plots:
+        write_figures(titration, output, filtered)
+
+def write_figures(titration, output, filtered):
+    "Writes last step histogram, filtered residues shift map and titration curves as PNG images"
+    import matplotlib
+    matplotlib.use('Agg')
+    if not titration.dataSteps:
+        return
+    save_figure(titration.plot_hist(-1, show=False), os.path.join(output, 'hist.png'))
+    residues = [titration.residues[position] for position in filtered]
+    if residues:
+        save_figure(titration.plot_shiftmap(residues, show=False), os.path.join(output, 'shiftmap.png'))
+    if residues and titration.isInit:
+        os.makedirs(os.path.join(output, 'curves'), exist_ok=True)
+        for residue in residues:
+            save_figure(titration.plot_titration(residue, show=False),
+                        os.path.join(output, 'curves', '{position}.png'.format(position=residue.position)))
+
+def save_figure(figure, path):
+    "Writes `figure` to `path` as PNG image, and closes it"
+    figure.figure.savefig(path, dpi=figure.figure.dpi)
+    figure.close()
+
+def run_batch(sources, output, cutoff=None, initFile=None, fit=True, plots=True, workers=None):
+    """
+    Processes titration `sources` in parallel processes, writing their results
+    to subdirectories of `output` directory, see process_titration().
+    Returns list of summary dicts, also written to `summary.csv` in `output`.
+    """
+    os.makedirs(output, exist_ok=True)
+    dirs = output_dirs(sources, output)
+    workers = min(workers or os.cpu_count() or 1, len(sources))
+    arguments = [(source, outputDir, cutoff, initFile, fit, plots) for source, outputDir in zip(sources, dirs)]
+    summaries = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_titration, *args) for args in arguments]
+            for future in futures:
+                summaries.append(future.result())
+                report(summaries[-1])
+    else:
+        for args in arguments:
+            summaries.append(process_titration(*args))
+            report(summaries[-1])
+
+    with open(os.path.join(output, 'summary.csv'), 'w', newline='') as summaryFile:
+        writer = csv.DictWriter(summaryFile, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
+    return summaries
+
+def report(summary):
+    "Prints a line reporting processed titration `summary`"
+    if summary["error"]:
+        print("[Batch]\tFailed {source} : {error}".format(**summary), file=sys.stderr)
+    else:
+        print("[Batch]\tProcessed {source} : {complete} complete residues, {filtered} filtered, "
+            "{fitted} fitted, written to {output}".format(**summary), file=sys.stderr)
@@ -107,11 +107,8 @@ class IntensityBarPlot(TitrationWidget, bqplot.Figure):
 
     def update_cutoff(self):
         self.cutoff.y = [self.titration.cutoff]*2
-        selection = []
-        for idx, intensity in enumerate(self.bar_chart.y):
-            if intensity >= self.titration.cutoff:
-                selection.append(idx)
-        self.bar_chart.selected = selection
+        self.bar_chart.selected = self.titration.indices_between(
+            low=self.titration.cutoff, step=self.step).tolist()
 
     def set_step(self, change):
         self.step = change['new']
@@ -333,7 +330,7 @@ class TitrationCurve(TitrationWidget, bqplot.Figure):
 
         self.res = self.titration.complete[residue]
 
-        self.x_data = self.titration.protocole.iloc[:, [5]].values.T.tolist().pop() # concentration ratios
+        self.x_data = self.titration.concentrationRatio
         self.y_data = self.res.chemshiftIntensity
 
         self.scatter = bqplot.Scatter(
@@ -363,7 +360,7 @@ class TitrationCurve(TitrationWidget, bqplot.Figure):
         self.update()
 
     def update(self):
-        self.scatter.x = self.titration.protocole.iloc[:, [5]].values.T.tolist().pop()
+        self.scatter.x = self.titration.concentrationRatio
         self.scatter.y = self.res.chemshiftIntensity
         self.set_tooltips()
 
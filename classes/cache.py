@@ -0,0 +1,121 @@
+""" Parse cache module
+
+Persistent cache of parsed titration files, stored in user cache directory.
+Each `.list` file gets one `.npz` entry holding its parsed arrays, along with
+its path, size, modification time and content hash.
+An entry is reused only if all of these still match the file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+class ParseCache(object):
+    """
+    Class ParseCache.
+    Maps titration file paths to their parsed content, i.e. a dict of arrays
+    with keys position, chemshiftH and chemshiftN.
+    Cache failures are never fatal : entries that cannot be read or written are ignored.
+    """
+
+    VERSION = 1
+    FIELDS = ("position", "chemshiftH", "chemshiftN")
+    MAX_AGE = 30 * 24 * 3600 # seconds an entry may stay unused before eviction
+    TMP_MAX_AGE = 3600 # seconds after which a temporary file is considered abandoned
+
+    def __init__(self, directory=None):
+        self.directory = directory or self.default_directory()
+
+    @staticmethod
+    def default_directory():
+        "User cache directory, following XDG base directory specification"
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(root, 'shift2me', 'parse')
+
+## -----------------------------------------------------------
+##      Entries
+## -----------------------------------------------------------
+
+    def entry_path(self, path):
+        "Cache entry file for titration file at `path`"
+        digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.directory, digest + '.npz')
+
+    def make_key(self, path, content):
+        "Cache key of titration file at `path`, which text is `content`"
+        stat = os.stat(path)
+        return {
+            "version": self.VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": hashlib.sha1(content.encode()).hexdigest()
+        }
+
+    def get(self, key):
+        """
+        Returns parsed content stored for `key`, or None if there is no valid entry.
+        Stale entries are evicted.
+        """
+        entryPath = self.entry_path(key["path"])
+        parsed = None
+        try:
+            with np.load(entryPath, allow_pickle=False) as entry:
+                if json.loads(str(entry["key"])) == key:
+                    parsed = {field: entry[field] for field in self.FIELDS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            pass
+        if parsed is None:
+            self.remove(entryPath)
+            return None
+        # mark entry as used
+        try:
+            os.utime(entryPath)
+        except OSError:
+            pass
+        return parsed
+
+    def put(self, key, parsed):
+        "Stores `parsed` content for `key`, replacing existing entry"
+        entryPath = self.entry_path(key["path"])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to temporary file first, so that concurrent readers never see partial entries
+            fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as tmpFile:
+                np.savez(tmpFile, key=np.array(json.dumps(key)),
+                        **{field: parsed[field] for field in self.FIELDS})
+            os.replace(tmpPath, entryPath)
+        except OSError:
+            pass
+
+    @staticmethod
+    def remove(entryPath):
+        try:
+            os.remove(entryPath)
+        except OSError:
+            pass
+
+    def evict(self, maxAge=None):
+        "Removes entries unused for more than `maxAge` seconds, and leftover temporary files"
+        maxAge = self.MAX_AGE if maxAge is None else maxAge
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            entryPath = os.path.join(self.directory, name)
+            try:
+                age = now - os.stat(entryPath).st_mtime
+                if age > maxAge or (name.endswith('.tmp') and age > self.TMP_MAX_AGE):
+                    self.remove(entryPath)
+            except OSError:
+                pass
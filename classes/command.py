@@ -1,6 +1,9 @@
 import os
+from collections import OrderedDict
 from cmd2 import Cmd, options, make_option
 from classes.Titration import Titration
+from classes import job
+from classes.profiler import Profiler
 from tabulate import tabulate
 
 class ShiftShell(Cmd):
@@ -14,6 +17,7 @@ class ShiftShell(Cmd):
         self.allow_cli_args = False
 
         self.titration =  kwargs.get('titration')
+        self.profiler = kwargs.get('profiler') or Profiler()
 
         # environment attributes
         self.name = self.titration.name
@@ -34,6 +38,7 @@ class ShiftShell(Cmd):
         self.complete_make_init=self.path_complete
         self.complete_init=self.path_complete
         self.complete_update=self.path_complete
+        self.complete_profile=self.path_complete
 
         self.intro = "\n".join([  "\n\n\tWelcome to Shift2Me !",
                                 "{summary}\n{intro}".format(
@@ -147,6 +152,8 @@ class ShiftShell(Cmd):
         """Update titration from <source>.
         If source is a directory, will add all the .list files.
         with appropriate naming regarding expected next steps.
+        Source may also be a tar or zip archive, or a directory within one,
+        like data/listes.tar.gz/listes/listPP. Gzip compressed .list.gz files are accepted too.
         If source is a list of files, add all the files,
         checking they have correct name regarding expected steps.
         No argument uses directory from first invocation, looking for
@@ -165,6 +172,26 @@ class ShiftShell(Cmd):
             self.pfeedback(error)
             return
 
+    @options([make_option('-i', '--interval', type="float", default=1.0, help="Seconds between directory polls"),
+            make_option('-s', '--settle', type="float", default=2.0,
+                        help="Seconds a new file must stay unchanged before it is loaded")],
+            arg_desc='[stop]')
+    def do_watch(self, arg, opts=None):
+        """Watch titration directory, adding new titration steps as soon as their files are written.
+        Open histograms are plotted again after each command.
+        Steps with far less residues than previous ones are skipped until their file changes,
+        use `update` to load them anyway.
+        Invocation with `stop` argument stops watching.
+        Example : watch -i 5
+        """
+        if arg and arg[0] == 'stop':
+            self.titration.unwatch()
+            self.pfeedback("Stopped watching {dir}.".format(dir=self.titration.dirPath))
+        elif arg:
+            self.do_help('watch')
+        elif self.titration.watch(interval=opts.interval, settle=opts.settle):
+            self.pfeedback("Watching {dir} for new titration steps.".format(dir=self.titration.dirPath))
+
     @options([make_option('-v', '--volume', help="Volume of titrant solution to add titration step")],arg_desc='<titration_file_##.list>')
     def do_add_step(self, arg, opts=None):
         """Add a titration file as next step. Associate a volume to this step with -v option.
@@ -175,28 +202,35 @@ class ShiftShell(Cmd):
         else:
             self.do_help("add_step")
 
-    def do_save_job(self, arg):
-        """Save active titration to binary pickle formatted file.
-         Argument may be a file path to write into. 
-         Invocation with no argument saves to a pickle formatted file named as your titration is.
+    @options([make_option('-z', '--compress', choices=sorted(job.CODECS),
+                        help="Compress saved data using given codec : zlib, lzma or bz2")],
+            arg_desc='[<path>]')
+    def do_save_job(self, arg, opts=None):
+        """Save active titration to binary job file.
+         Argument may be a file path to write into.
+         Invocation with no argument saves to a job file named as your titration is.
+         Example : save_job my_titration.s2m -z zlib
          """
+        arg = arg[0] if arg else ''
         if not arg or os.path.isdir(arg):
-            path = os.path.join(arg, '{titration}.pkl'.format(titration=self.titration.name))
-        elif not arg.endswith(".pkl"):
-            path = arg + ".pkl"
+            path = os.path.join(arg, '{titration}{ext}'.format(titration=self.titration.name, ext=job.EXTENSION))
+        elif not arg.endswith(job.EXTENSION):
+            path = arg + job.EXTENSION
         else:
             path = arg
-        self.titration.save(path)
-        self.pfeedback("Saved job at : {path}.".format(path = path))
+        if self.titration.save(path, compression=opts.compress):
+            self.pfeedback("Saved job at : {path}.".format(path = path))
 
     def do_load_job(self, arg):
-        "Load previously saved titration in pickle format, replacing active titration."
+        "Load previously saved titration job file, replacing active titration."
+        if not arg:
+            self.do_help('load_job')
+            return
         self.pfeedback('Loading titration from : {source}'.format(source=arg))
-        try:
-            self.titration.load(arg)
+        if self.titration.load(arg):
+            self.name = self.titration.name
+            self._set_prompt()
             self.pfeedback('Now working on : {titration}'.format(titration=self.titration.name))
-        except:
-            return
 
     @options([], arg_desc="( filtered | selected | complete | incomplete )")
     def do_residues(self, args, opts=None):
@@ -220,9 +254,25 @@ class ShiftShell(Cmd):
                 self.pfeedback(error)
                 continue
 
+    @options([make_option('-s', '--step', type="int", default=-1, help="Titration step, last step by default")],
+            arg_desc='[<low> [<high>]]')
     def do_filter(self, args, opts=None):
-        "Output residues having their intensity superior or equal to current cutoff."
-        self.poutput(" ".join([str(pos) for pos in self.titration.filtered]))
+        """Output residues having their intensity superior or equal to current cutoff.
+        Given bounds, output residues having their intensity between <low> and <high> at titration step.
+        Example : filter -s 7 0.05 0.2
+        """
+        try:
+            if not args and opts.step == -1:
+                residues = self.titration.filtered
+            else:
+                bounds = [float(arg) for arg in args[:2]]
+                if not bounds and self.titration.cutoff is not None:
+                    bounds = [self.titration.cutoff]
+                residues = self.titration.residues_between(*bounds, step=opts.step)
+            self.poutput(" ".join([str(pos) for pos in residues]))
+        except (ValueError, IndexError) as error:
+            self.pfeedback(error)
+            self.do_help("filter")
 
     @options([], arg_desc="[all] [filtered] [complete] [incomplete] [positions_slice]")
     def do_select(self, args, opts=None):
@@ -301,11 +351,76 @@ class ShiftShell(Cmd):
             self.pfeedback(error)
             self.do_help("cutoff")
 
+    @options([make_option('-g', '--global', action="store_true", dest="shared",
+                        help="Fit a single Kd shared by all residues"),
+            make_option('-x', '--exclude-outliers', action="store_true",
+                        help="With --global, fit again without outlier residues"),
+            make_option('-b', '--bootstrap', type="int", metavar="REPLICATES",
+                        help="Estimate Kd confidence intervals from fits of resampled replicates"),
+            make_option('-m', '--method', choices=['residual', 'montecarlo'], default='residual',
+                        help="Resampling method, either residual (bootstrap) or montecarlo (default: %default)"),
+            make_option('-l', '--level', type="float", default=0.95, help="Confidence level (default: %default)"),
+            make_option('--seed', type="int", default=0, help="Random seed of resampling (default: %default)"),
+            make_option('-e', '--export', help="Export fit results as CSV file")],
+            arg_desc="[filtered] [selected] [complete] [positions_slice]")
+    def do_fit(self, args, opts=None):
+        """Fit titration curves to a single binding site model, accounting for ligand depletion.
+        Outputs dissociation constant Kd (µM) and intensity at saturation for each residue.
+        With --global, Kd is shared by all residues, and residues with unusually high residuals are flagged as outliers.
+        With --bootstrap, Kd confidence intervals are estimated and shown as bands by curve command.
+        Residues are either :
+         - a predefined set of residues
+         - 1 or more slices of residue positions, see `help select`
+        Defaults to selected residues, or filtered residues if none is selected.
+        Incomplete residues are skipped. Fitted curves are then shown by curve command.
+        Examples :
+            >> fit filtered 100:110
+            >> fit -g -x filtered
+            >> fit -b 1000 -m montecarlo selected
+        """
+        argMap = {
+            "filtered" : self.titration.filtered,
+            "selected" : self.titration.selected,
+            "complete" : self.titration.complete
+        }
+        try:
+            positions = None
+            if args:
+                positions = []
+                for arg in args:
+                    positions += list(argMap[arg]) if arg in argMap else self.parse_residue_slice([arg])
+                skipped = [pos for pos in positions if pos not in self.titration.complete]
+                if skipped:
+                    self.pfeedback("Skipping incomplete or unknown residues : {positions}".format(
+                        positions=" ".join(map(str, skipped))))
+                positions = list(OrderedDict.fromkeys(pos for pos in positions if pos in self.titration.complete))
+            if opts.shared:
+                fit = self.titration.fit_global(positions)
+                if opts.exclude_outliers and fit['outlier'].any():
+                    self.pfeedback("Excluding outlier residues : {positions}".format(
+                        positions=" ".join(map(str, fit.index[fit['outlier']]))))
+                    fit = self.titration.fit_global(list(fit.index[~fit['outlier']]))
+            else:
+                fit = self.titration.fit_binding(positions)
+            if opts.bootstrap:
+                fit = self.titration.bootstrap_fit(opts.bootstrap, method=opts.method,
+                                                seed=opts.seed, level=opts.level)
+            self.poutput(tabulate(fit, headers='keys', tablefmt='psql', floatfmt='.4g'))
+            if opts.shared and len(fit):
+                self.poutput("Shared Kd : {kd:.4g} ± {error:.2g} µM over {count} residues".format(
+                    kd=fit['Kd'].iloc[0], error=fit['KdError'].iloc[0], count=len(fit)))
+            if opts.export:
+                fit.to_csv(opts.export)
+        except ValueError as error:
+            self.pfeedback(error)
+
 ## PLOTTING CMDS ------------------------------
 
     @options([],arg_desc='residue [residue ...]')
     def do_curve(self, arg, opts=None):
-        "Show titration curve of one or several residues."
+        """Show titration curve of one or several residues.
+        Fitted binding curve is shown as well, for residues fitted with fit command.
+        """
         if not arg:
             self.do_help('curve')
         elif not self.titration.isInit:
@@ -315,16 +430,26 @@ class ShiftShell(Cmd):
             for residue in arg:
                 self.titration.plot_titration(self.titration.complete.get(int(residue)))
 
-    @options([make_option('-e', '--export', help="Export hist as PNG image")],
+    @options([make_option('-e', '--export', help="Export hist as PNG image"),
+            make_option('-m', '--heatmap', action="store_true",
+                        help="Plot all steps as a single residue x step intensity heatmap")],
             arg_desc='(<titration_step> | all)')
     def do_hist(self, args, opts=None):
         """Plot chemical shift intensity per residu as histograms.
         Accepted arguments are any titration step.
         or 'all' to plot all steps as stacked histograms.
         Invocation with no argument plots the last step.
+        With --heatmap option, all steps are plotted as a heatmap,
+        with intensities above cut off outlined, which scales to many steps.
         """
         step = args[0] if args else self.titration.dataSteps -1
-        if step == 'all': # plot stacked hist
+        if opts.heatmap: # plot all steps as heatmap
+            try:
+                hist = self.titration.plot_heatmap()
+            except ValueError as error:
+                self.pfeedback(error)
+                return
+        elif step == 'all': # plot stacked hist
             hist = self.titration.plot_hist()
         else: # plot single hist
             hist = self.titration.plot_hist(step=int(step))
@@ -334,11 +459,17 @@ class ShiftShell(Cmd):
 
     @options([
         make_option('-s', '--split', action="store_true", help="Sublot each residue individually"),
-        make_option('-e', '--export', help="Export 2D shifts map as PNG image")
+        make_option('-p', '--page', type="int", default=1,
+                    help="Page of split shift map to show, for more than 36 residues. Default 1"),
+        make_option('-e', '--export', help="Export 2D shifts map as PNG image. "
+                    "Split maps are exported with all their pages, as a multi-page PDF or a PNG image per page"),
+        make_option('-r', '--rasterize', action="store_true",
+                    help="Rasterize chem shifts in exported PDF or SVG image. Default for more than 1000 residues")
     ],
     arg_desc='( complete | filtered | selected )')
     def do_shiftmap(self, args, opts=None):
         """Plot chemical shifts for H and N atoms for each residue at all titration steps.
+        Split shift maps of more than 36 residues are paginated.
         """
         argMap = {
             "complete" : self.titration.complete,
@@ -351,14 +482,73 @@ class ShiftShell(Cmd):
                 return
             if args[0] not in argMap:
                 raise ValueError("Invalid argument : {arg}. Use `shiftmap -h` for help.".format(arg=args[0]))
-            residues = argMap[args[0]].values()
-            fig = self.titration.plot_shiftmap(residues, split=opts.split)
-            if opts.export:
+            residues = list(argMap[args[0]].values())
+            rasterized = opts.rasterize or None
+            fig = self.titration.plot_shiftmap(residues, split=opts.split, rasterized=rasterized, page=opts.page - 1)
+            split = opts.split and len(residues) > 1
+            if split and fig.layout.pages > 1:
+                self.pfeedback("Showing page {page} of {pages}, see --page option.".format(
+                                page=opts.page, pages=fig.layout.pages))
+            if opts.export and split: # export all pages
+                files = self.titration.export_split_shiftmap(fig.layout, opts.export, rasterized=rasterized)
+                self.pfeedback("Split shift map written to {files}".format(files=", ".join(files)))
+            elif opts.export:
                 fig.figure.savefig(opts.export, dpi=fig.figure.dpi)
         except ValueError as invalidArgErr:
             self.pfeedback(invalidArgErr)
             return
 
+## SESSION CMDS -------------------------------
+    @options([make_option('-n', '--top', type="int", help="Number of functions listed in reports"),
+            make_option('-d', '--directory', help="Write each command profile as .pstats file in directory")],
+            arg_desc='( on | off | dump <file.pstats> )')
+    def do_profile(self, arg, opts=None):
+        """Profile following commands, reporting time, peak memory and top functions by cumulative time.
+        `dump` writes profiles of all commands so far as a single .pstats file, for offline analysis.
+        Invocation with no argument prints profiling status.
+        Example : profile on -n 20 -d profiles/
+        """
+        if not arg:
+            self.pfeedback(self.profiler.status)
+        elif arg[0] == 'on':
+            self.profiler.enable(directory=opts.directory, top=opts.top)
+            self.pfeedback(self.profiler.status)
+        elif arg[0] == 'off':
+            self.profiler.disable()
+            self.pfeedback(self.profiler.status)
+        elif arg[0] == 'dump' and len(arg) == 2:
+            try:
+                self.pfeedback("Wrote profiles to {path}".format(path=self.profiler.dump(arg[1])))
+            except (ValueError, OSError) as error:
+                self.pfeedback(error)
+        else:
+            self.do_help('profile')
+
+    @options([], arg_desc='[ on | off | reset ]')
+    def do_stats(self, arg, opts=None):
+        """Print titration metrics : time spent parsing files, updating complete residues,
+        calculating intensities and plotting figures, along with data read and parse cache use.
+        Timers of files parsed concurrently add up, and may exceed loading time.
+        Metrics collection is off by default : it may be turned on or off, and reset.
+        """
+        if not arg:
+            if not self.titration.metrics.enabled:
+                self.pfeedback("Metrics collection is off, turn it on with `stats on`.")
+            stats = self.titration.stats
+            if not stats:
+                self.pfeedback("No metrics collected.")
+                return
+            rows = [(name, "{:.4g}".format(value) if isinstance(value, float) else value)
+                    for name, value in stats.items()]
+            self.poutput(tabulate(rows, headers=["metric", "value"], tablefmt='psql'))
+        elif arg[0] in ('on', 'off'):
+            self.titration.metrics.enabled = arg[0] == 'on'
+            self.pfeedback("Metrics collection is {state}.".format(state=arg[0]))
+        elif arg[0] == 'reset':
+            self.titration.metrics.reset()
+        else:
+            self.do_help('stats')
+
 ## --------------------------------------------
 ##      UTILS
 ## --------------------------------------------
@@ -401,8 +591,30 @@ class ShiftShell(Cmd):
         """
         """Override this so prompt always displays cwd."""
         self._set_prompt()
+        # plot again hists changed by watched steps
+        self.titration.refresh_hists()
         return stop
 
+    def onecmd_plus_hooks(self, line):
+        "Runs command holding titration lock, so that watched steps are not added meanwhile."
+        with self.titration.lock:
+            return Cmd.onecmd_plus_hooks(self, line)
+
+    def onecmd(self, line):
+        """Runs command `do_*` method, profiled if profiling is on, see `profile`.
+        Command parsing and hooks are left out of profiles, as well as `profile` command itself.
+        """
+        statement = self.parser_manager.parsed(line)
+        funcname = self._func_named(statement.parsed.command)
+        if not self.profiler.enabled or funcname in (None, 'do_profile'):
+            return Cmd.onecmd(self, statement)
+        try:
+            func = getattr(self, funcname)
+        except AttributeError:
+            return self.default(statement)
+        with self.profiler.measure(statement.parsed.raw.strip()):
+            return func(statement)
+
 ## --------------------------------------------------------
 ##    COMPLETERS
 ## --------------------------------------------------------
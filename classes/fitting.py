@@ -0,0 +1,285 @@
+""" Binding fit module
+
+Fitting of titration curves to a single binding site model, in fast exchange regime.
+Chem shift intensity of a residue follows the fraction of bound analyte :
+    intensity = deltaMax * |bound(titrant) - bound(titrant at reference step)|
+    bound = ((A + T + Kd) - sqrt((A + T + Kd)^2 - 4 * A * T)) / (2 * A)
+where A and T are total analyte and titrant concentrations, accounting for ligand depletion.
+
+For a given Kd, the model is linear in deltaMax, which optimal value is solved exactly.
+Per residue fits only search Kd, on a log scale and for all residues at once :
+first on a coarse grid, then by golden section search around best grid point.
+Global fits share a single Kd between residues, and solve all parameters by sparse least squares.
+
+Uncertainty is estimated by resampling : replicates of fitted curves, perturbed either by residuals
+drawn with replacement (residual bootstrap) or by gaussian noise (Monte Carlo), are fitted again.
+Replicates are fitted in batches, as a single (replicate x residue x step) array.
+"""
+
+import numpy as np
+
+GRID_SIZE = 64 # coarse log10(Kd) grid points
+ITERATIONS = 30 # golden section search iterations, each one narrowing interval by 0.618
+OUTLIER_SCORE = 3.5 # robust z-score of residue RMSD above which a residue is an outlier in global fits
+RESAMPLING_METHODS = ('residual', 'montecarlo')
+KD_RANGE = 1e3 # Kd is searched within [min concentration / KD_RANGE, max concentration * KD_RANGE]
+GOLDEN = (np.sqrt(5) - 1) / 2
+
+def bound_fraction(kd, titrant, analyte):
+    """
+    Fraction of analyte bound to titrant, for dissociation constant(s) `kd`
+    and total `titrant` and `analyte` concentrations, broadcast together.
+    """
+    b = analyte + titrant + kd
+    # rationalized quadratic root, accurate for small kd
+    return 2 * titrant / (b + np.sqrt(np.maximum(b**2 - 4 * analyte * titrant, 0)))
+
+def kd_bounds(titrant, analyte):
+    "Returns (low, high) log10(Kd) search interval for titrant and analyte concentrations"
+    concentrations = np.concatenate((titrant, analyte))
+    concentrations = concentrations[concentrations > 0]
+    return (np.log10(concentrations.min() / KD_RANGE), np.log10(concentrations.max() * KD_RANGE))
+
+def model_basis(kd, titrant, analyte, reference=0):
+    "Model intensities for deltaMax = 1, broadcasting `kd` against steps on last axis"
+    fraction = bound_fraction(kd, titrant, analyte)
+    return np.abs(fraction - fraction[..., reference, np.newaxis])
+
+def model_basis_derivative(kd, titrant, analyte, reference=0):
+    "Derivative of model_basis() with respect to log10(Kd), for a scalar `kd`"
+    fraction = bound_fraction(kd, titrant, analyte)
+    b = analyte + titrant + kd
+    # d(fraction)/d(Kd) = -fraction / sqrt(b^2 - 4 * A * T)
+    derivative = -fraction / np.sqrt(np.maximum(b**2 - 4 * analyte * titrant, 1e-300)) * kd * np.log(10)
+    return np.sign(fraction - fraction[reference]) * (derivative - derivative[reference])
+
+def profile_gain(basis, intensities):
+    """
+    Returns squared intensities norm minus residual sum of squares of profile(), with opposite sign.
+    Cheaper than profile(), and minimal at the same Kd.
+    """
+    basisNorm = np.sum(basis**2, axis=-1)
+    projection = np.sum(basis * intensities, axis=-1)
+    return -projection**2 / np.maximum(basisNorm, 1e-300)
+
+def profile(basis, intensities):
+    """
+    Returns (rss, deltaMax) of intensities best fitting `basis` curves, deltaMax being solved exactly.
+    `basis` and `intensities` are (... x step) arrays broadcast together.
+    """
+    basisNorm = np.sum(basis**2, axis=-1)
+    projection = np.sum(basis * intensities, axis=-1)
+    deltaMax = np.where(basisNorm > 0, projection / np.where(basisNorm > 0, basisNorm, 1), 0)
+    rss = np.sum((intensities - deltaMax[..., np.newaxis] * basis)**2, axis=-1)
+    return rss, deltaMax
+
+def fit_curves(intensities, titrant, analyte, reference=0):
+    """
+    Fits (residue x step) `intensities` to single site binding model,
+    with `titrant` and `analyte` concentrations at each step.
+    Returns dict of per residue arrays :
+        - Kd : dissociation constant, in concentrations unit
+        - deltaMax : intensity at saturation
+        - rss : residual sum of squares
+        - r2 : coefficient of determination
+        - bounded : True if Kd reached search interval bound, i.e. is not determined by data
+    """
+    intensities = np.asarray(intensities, dtype=float)
+    titrant, analyte = np.asarray(titrant, dtype=float), np.asarray(analyte, dtype=float)
+    residueCount = len(intensities)
+    low, high = kd_bounds(titrant, analyte)
+
+    # coarse grid : (grid x step) basis against all residues
+    grid = np.linspace(low, high, GRID_SIZE)
+    gridBasis = model_basis(10**grid[:, np.newaxis], titrant, analyte, reference)
+    gridRss = (np.sum(intensities**2, axis=1)[:, np.newaxis]
+                - np.dot(intensities, gridBasis.T)**2 / np.maximum(np.sum(gridBasis**2, axis=1), 1e-300))
+    best = np.argmin(gridRss, axis=1)
+
+    def evaluate(logKd):
+        return profile_gain(model_basis(10**logKd[:, np.newaxis], titrant, analyte, reference), intensities)
+    logKd = golden_search(evaluate, grid, best)
+    rss, deltaMax = profile(model_basis(10**logKd[:, np.newaxis], titrant, analyte, reference), intensities)
+    totalSquares = np.sum((intensities - intensities.mean(axis=1)[:, np.newaxis])**2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(totalSquares > 0, 1 - rss / totalSquares, np.nan)
+    tolerance = (high - low) / (GRID_SIZE - 1) * 1e-3
+    # Kd is undetermined without chem shift variation
+    logKd[~np.any(intensities, axis=1)] = np.nan
+    return {
+        "Kd" : 10**logKd,
+        "deltaMax" : deltaMax,
+        "rss" : rss,
+        "r2" : r2,
+        "bounded" : (logKd - low < tolerance) | (high - logKd < tolerance) if residueCount else np.zeros(0, dtype=bool)
+    }
+
+def golden_search(evaluate, grid, best):
+    """
+    Golden section search of minima of `evaluate`, a function of a log10(Kd) array,
+    computing one value for each searched minimum.
+    Each minimum is searched between neighbours of `best` indices in `grid`.
+    Returns array of log10(Kd) at minima.
+    """
+    lower = grid[np.maximum(best - 1, 0)]
+    upper = grid[np.minimum(best + 1, len(grid) - 1)]
+    left = upper - GOLDEN * (upper - lower)
+    right = lower + GOLDEN * (upper - lower)
+    leftValue, rightValue = evaluate(left), evaluate(right)
+    for _ in range(ITERATIONS):
+        moveLeft = leftValue < rightValue # minimum lies in [lower, right]
+        upper = np.where(moveLeft, right, upper)
+        lower = np.where(moveLeft, lower, left)
+        left, right = (np.where(moveLeft, upper - GOLDEN * (upper - lower), right),
+                    np.where(moveLeft, left, lower + GOLDEN * (upper - lower)))
+        # only one new point per minimum needs evaluation
+        newValue = evaluate(np.where(moveLeft, left, right))
+        leftValue, rightValue = np.where(moveLeft, newValue, rightValue), np.where(moveLeft, leftValue, newValue)
+    return (lower + upper) / 2
+
+def fit_curve(intensities, titrant, analyte, reference=0):
+    "Fits a single residue `intensities`, see fit_curves(). Returns dict of scalars."
+    fit = fit_curves(np.asarray(intensities)[np.newaxis], titrant, analyte, reference)
+    return dict((key, value[0].item()) for key, value in fit.items())
+
+def fit_global(intensities, titrant, analyte, reference=0):
+    """
+    Fits (residue x step) `intensities` to single site binding model, with a Kd shared by all residues,
+    and a deltaMax for each residue.
+    Parameters are log10(Kd) and deltaMax values, solved by least squares starting from best Kd on a coarse grid.
+    The Jacobian is built explicitly as a sparse matrix : residuals of a residue only depend on Kd
+    and its own deltaMax, so it holds 2 values per residual, whatever the number of residues.
+    Returns dict with :
+        - Kd : shared dissociation constant, in concentrations unit
+        - KdError : Kd standard error
+        - bounded : True if Kd reached search interval bound
+        - and per residue arrays deltaMax, rss, r2, outlier, the latter flagging residues
+          with unusually high residuals, see OUTLIER_SCORE
+    """
+    # scipy is slow to import, and only needed here
+    from scipy import sparse
+    from scipy.optimize import least_squares
+
+    intensities = np.asarray(intensities, dtype=float)
+    titrant, analyte = np.asarray(titrant, dtype=float), np.asarray(analyte, dtype=float)
+    residueCount, stepCount = intensities.shape
+    low, high = kd_bounds(titrant, analyte)
+
+    # coarse grid of shared Kd, deltaMax being solved exactly
+    grid = np.linspace(low, high, GRID_SIZE)
+    gridBasis = model_basis(10**grid[:, np.newaxis], titrant, analyte, reference)
+    gridRss = (np.sum(intensities**2)
+                - np.sum(np.dot(intensities, gridBasis.T)**2, axis=0) / np.maximum(np.sum(gridBasis**2, axis=1), 1e-300))
+    start = grid[np.argmin(gridRss)]
+    startDeltaMax = profile(model_basis(10**start, titrant, analyte, reference), intensities)[1]
+
+    # each residual row has 2 non zero values : log10(Kd) column 0, residue deltaMax column 1 + residue
+    indices = np.empty((residueCount, stepCount, 2), dtype=int)
+    indices[..., 0] = 0
+    indices[..., 1] = 1 + np.arange(residueCount)[:, np.newaxis]
+    indices = indices.ravel()
+    indptr = np.arange(0, 2 * residueCount * stepCount + 1, 2)
+    shape = (residueCount * stepCount, residueCount + 1)
+
+    def residuals(parameters):
+        basis = model_basis(10**parameters[0], titrant, analyte, reference)
+        return (parameters[1:, np.newaxis] * basis - intensities).ravel()
+
+    def jacobian(parameters):
+        basis = model_basis(10**parameters[0], titrant, analyte, reference)
+        data = np.empty((residueCount, stepCount, 2))
+        data[..., 0] = parameters[1:, np.newaxis] * model_basis_derivative(10**parameters[0], titrant, analyte, reference)
+        data[..., 1] = basis
+        return sparse.csr_matrix((data.ravel(), indices, indptr), shape=shape)
+
+    bounds = (np.r_[low, np.full(residueCount, -np.inf)], np.r_[high, np.full(residueCount, np.inf)])
+    solution = least_squares(residuals, np.r_[start, startDeltaMax], jac=jacobian, bounds=bounds,
+                            method='trf', tr_solver='lsmr', x_scale='jac')
+    logKd, deltaMax = solution.x[0], solution.x[1:]
+
+    # log10(Kd) variance from normal equations, using Schur complement of diagonal deltaMax block
+    residueRss = np.sum(solution.fun.reshape(residueCount, stepCount)**2, axis=1)
+    kdColumn = solution.jac[:, 0].toarray().reshape(residueCount, stepCount)
+    basis = model_basis(10**logKd, titrant, analyte, reference)
+    basisNorm = np.sum(basis**2)
+    schur = np.sum(kdColumn**2) - (np.sum(np.dot(kdColumn, basis)**2) / basisNorm if basisNorm > 0 else 0)
+    freedom = residueCount * stepCount - residueCount - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.sum(residueRss) / freedom / schur if freedom > 0 else np.nan
+        kdError = 10**logKd * np.log(10) * np.sqrt(variance)
+        totalSquares = np.sum((intensities - intensities.mean(axis=1)[:, np.newaxis])**2, axis=1)
+        r2 = np.where(totalSquares > 0, 1 - residueRss / totalSquares, np.nan)
+
+    # robust z-score of residue RMSD, using median absolute deviation
+    rmsd = np.sqrt(residueRss / stepCount)
+    deviation = np.abs(rmsd - np.median(rmsd)) if residueCount else rmsd
+    mad = np.median(deviation) if residueCount else 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(mad > 0, 0.6745 * (rmsd - np.median(rmsd) if residueCount else rmsd) / mad, 0)
+    tolerance = (high - low) / (GRID_SIZE - 1) * 1e-3
+    return {
+        "Kd" : 10**logKd,
+        "KdError" : float(kdError),
+        "bounded" : bool(logKd - low < tolerance or high - logKd < tolerance),
+        "deltaMax" : deltaMax,
+        "rss" : residueRss,
+        "r2" : r2,
+        "outlier" : score > OUTLIER_SCORE
+    }
+
+def fit_shared(intensities, titrant, analyte, reference=0):
+    """
+    Fits a stack of (replicate x residue x step) `intensities` with a Kd shared by residues of each replicate.
+    As deltaMax values are solved exactly for a given Kd, this is a search of a single Kd per replicate,
+    reaching the same minimum as fit_global(), for all replicates at once.
+    Returns (Kd, deltaMax) as (replicate) and (replicate x residue) arrays.
+    """
+    low, high = kd_bounds(titrant, analyte)
+    grid = np.linspace(low, high, GRID_SIZE)
+    gridBasis = model_basis(10**grid[:, np.newaxis], titrant, analyte, reference)
+    gridRss = -np.sum(np.dot(intensities, gridBasis.T)**2, axis=1) / np.maximum(np.sum(gridBasis**2, axis=1), 1e-300)
+    def evaluate(logKd):
+        basis = model_basis(10**logKd[:, np.newaxis], titrant, analyte, reference)[:, np.newaxis]
+        return np.sum(profile_gain(basis, intensities), axis=1)
+    logKd = golden_search(evaluate, grid, np.argmin(gridRss, axis=1))
+    deltaMax = profile(model_basis(10**logKd[:, np.newaxis], titrant, analyte, reference)[:, np.newaxis], intensities)[1]
+    return 10**logKd, deltaMax
+
+def resample(fitted, residuals, replicates, method='residual', reference=0, random=np.random):
+    """
+    Returns (replicate x residue x step) replicates of (residue x step) `fitted` intensities, perturbed by :
+        - residual : `residuals` of each residue, drawn with replacement
+        - montecarlo : gaussian noise, with standard deviation estimated from `residuals` of each residue
+    Reference step, which intensity is always null, is left unchanged.
+    """
+    if method not in RESAMPLING_METHODS:
+        raise ValueError("Unknown resampling method {method} : accepted are {methods}".format(
+            method=method, methods=', '.join(RESAMPLING_METHODS)))
+    residueCount, stepCount = fitted.shape
+    steps = np.flatnonzero(np.arange(stepCount) != reference)
+    samples = np.repeat(fitted[np.newaxis], replicates, axis=0)
+    if method == 'residual':
+        picks = random.randint(len(steps), size=(replicates, residueCount, len(steps)))
+        noise = residuals[:, steps][np.arange(residueCount)[:, np.newaxis], picks]
+    else: # 2 fitted parameters per residue
+        sigma = np.sqrt(np.sum(residuals[:, steps]**2, axis=1) / max(len(steps) - 2, 1))
+        noise = random.normal(size=(replicates, residueCount, len(steps))) * sigma[:, np.newaxis]
+    samples[..., steps] += noise
+    return samples
+
+def bootstrap_batch(fitted, residuals, titrant, analyte, reference=0, replicates=1,
+                    method='residual', seed=None, shared=False):
+    """
+    Fits a batch of `replicates` resampled from `fitted` intensities and their `residuals`, see resample().
+    `seed` seeds batch random generator, so that batches are reproducible wherever they run.
+    If `shared` is set, each replicate is fitted with a Kd shared by all residues, see fit_shared().
+    Returns dict of Kd and deltaMax arrays, of (replicate) or (replicate x residue) shape.
+    """
+    random = np.random.RandomState(seed)
+    samples = resample(fitted, residuals, replicates, method, reference, random)
+    if shared:
+        kd, deltaMax = fit_shared(samples, titrant, analyte, reference)
+    else:
+        fit = fit_curves(samples.reshape(-1, samples.shape[-1]), titrant, analyte, reference)
+        kd, deltaMax = fit["Kd"].reshape(samples.shape[:2]), fit["deltaMax"].reshape(samples.shape[:2])
+    return {"Kd" : kd, "deltaMax" : deltaMax}
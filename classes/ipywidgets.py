@@ -92,6 +92,11 @@ class FloatControlWidget(AttrControlMixin, BoundedFloatText, WidgetKwargs):
         BoundedFloatText.__init__(self, *args,**kwargs)
         self.value = self.get_value()
 
+    def set_value(self, value):
+        "Set volume attribute, which protocole depends on"
+        AttrControlMixin.set_value(self, value)
+        self.titration.invalidate_protocole()
+
 
 class PanelContainer(VBox):
 
@@ -179,7 +184,7 @@ class ConcentrationWidget(AttrControlMixin, BoundedFloatText, WidgetKwargs):
 
     def set_value(self, value):
         "Set concentration for target molecule."
-        getattr(self.titration, self.endpoint)['concentration'] = value
+        self.titration.set_concentration(self.endpoint, value)
 
     def get_value(self):
         self.value = getattr(self.titration, self.endpoint)['concentration']
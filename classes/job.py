@@ -0,0 +1,150 @@
+""" Job file module
+
+Versioned binary format for saved titrations.
+A job file is laid out as :
+    - 8 bytes magic string
+    - format version, as little endian uint32
+    - header length, as little endian uint32
+    - JSON header, describing titration attributes and stored arrays
+    - raw arrays, each one starting at a multiple of ALIGNMENT bytes from file start
+Uncompressed arrays are loaded through memory mapping.
+Job files are written to a temporary file first, then moved over target path,
+so that arrays mapped onto a previous version of the file stay valid.
+Compressed arrays are compressed one by one, using a codec from the standard library.
+"""
+
+import bz2
+import json
+import lzma
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+EXTENSION = '.s2m'
+MAGIC = b'\x89S2MJOB\n'
+VERSION = 2
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<8sII')
+
+CODECS = {
+    'zlib' : zlib,
+    'lzma' : lzma,
+    'bz2' : bz2
+}
+
+def align(offset):
+    "Returns first multiple of ALIGNMENT greater or equal to `offset`"
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def write_job(path, attributes, arrays, compression=None):
+    """
+    Writes job file at `path`.
+    `attributes` is a JSON serializable dict, `arrays` is a dict of numpy arrays.
+    `compression` may be None or one of CODECS.
+    """
+    if compression is not None and compression not in CODECS:
+        raise ValueError("Unknown compression {codec} : accepted are {codecs}".format(
+            codec=compression, codecs=', '.join(sorted(CODECS))))
+
+    blocks = []
+    descriptions = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        if compression is not None:
+            data = CODECS[compression].compress(data)
+        descriptions[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset, # from data section start
+            "nbytes": len(data)
+        }
+        blocks.append((offset, data))
+        offset = align(offset + len(data))
+
+    header = json.dumps({
+        "compression": compression,
+        "attributes": attributes,
+        "arrays": descriptions
+    }).encode()
+    dataStart = align(PREAMBLE.size + len(header))
+
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, tempPath = tempfile.mkstemp(prefix='.' + name, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as jobFile:
+            jobFile.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            jobFile.write(header)
+            for blockOffset, data in blocks:
+                jobFile.seek(dataStart + blockOffset)
+                jobFile.write(data)
+            jobFile.truncate(dataStart + offset)
+        # temporary files are only readable by their owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tempPath, 0o666 & ~umask)
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+    return path
+
+def mapped_file(array):
+    "Returns path of file `array` is memory mapped onto, None if it is not mapped"
+    while array is not None:
+        if isinstance(array, np.memmap) and array.filename is not None:
+            return array.filename
+        array = array.base
+    return None
+
+def read_header(jobFile):
+    """
+    Reads and checks preamble and header from open job file.
+    Returns header dict, with an additional `dataStart` key.
+    Raises ValueError if file is not a job file, or was written by a newer format version.
+    """
+    preamble = jobFile.read(PREAMBLE.size)
+    if len(preamble) < PREAMBLE.size:
+        raise ValueError("{file} is not a job file".format(file=jobFile.name))
+    magic, version, headerLength = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise ValueError("{file} is not a job file".format(file=jobFile.name))
+    if version > VERSION:
+        raise ValueError("{file} was saved with job format version {version}, "
+                        "only versions up to {supported} are supported".format(
+                            file=jobFile.name, version=version, supported=VERSION))
+    header = json.loads(jobFile.read(headerLength).decode())
+    if header["compression"] is not None and header["compression"] not in CODECS:
+        raise ValueError("{file} uses unknown compression {codec}".format(
+            file=jobFile.name, codec=header["compression"]))
+    header["version"] = version
+    header["dataStart"] = align(PREAMBLE.size + headerLength)
+    return header
+
+def read_job(path):
+    """
+    Reads job file at `path`.
+    Returns (attributes, arrays) as passed to write_job.
+    Uncompressed arrays are copy-on-write memory maps : modifying them never alters the file.
+    """
+    with open(path, 'rb') as jobFile:
+        header = read_header(jobFile)
+        compression = header["compression"]
+        arrays = {}
+        for name, description in header["arrays"].items():
+            dtype, shape = np.dtype(description["dtype"]), tuple(description["shape"])
+            offset = header["dataStart"] + description["offset"]
+            if compression is not None:
+                jobFile.seek(offset)
+                data = CODECS[compression].decompress(jobFile.read(description["nbytes"]))
+                arrays[name] = np.frombuffer(bytearray(data), dtype=dtype).reshape(shape)
+            elif not description["nbytes"]:
+                # empty arrays cannot be mapped
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape)
+    return header["attributes"], arrays
@@ -0,0 +1,91 @@
+""" Metrics module
+
+Lightweight counters and timers, collected by titrations as they load and process data.
+Disabled metrics cost a single attribute check per measured operation.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class NullTimer(object):
+    "Timer doing nothing, used while metrics are disabled"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+    "Context manager adding wall clock time spent in enclosed block to metrics timer `name`"
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics(object):
+    """
+    Class Metrics.
+    Named counters, and named timers holding call count and total seconds.
+    Metrics may be updated from several threads, e.g. concurrent file parsing.
+    Timers of concurrent blocks add up, so that they may exceed wall clock time.
+    Metrics are disabled by default.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = OrderedDict() # {name: value}
+        self.timers = OrderedDict() # {name: [calls, seconds]}
+
+    def count(self, name, value=1):
+        "Adds `value` to counter `name`"
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def time(self, name):
+        "Returns context manager timing enclosed block as timer `name`"
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def add_time(self, name, seconds):
+        "Adds a call lasting `seconds` to timer `name`"
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def seconds(self, name):
+        "Total seconds of timer `name`"
+        return self.timers.get(name, (0, 0.0))[1]
+
+    def reset(self):
+        "Drops all collected metrics"
+        with self.lock:
+            self.counters = OrderedDict()
+            self.timers = OrderedDict()
+
+    def as_dict(self):
+        "Returns metrics as a flat dict : counters, then `<timer>Calls` and `<timer>Seconds` for each timer"
+        with self.lock:
+            metrics = OrderedDict(self.counters)
+            for name, (calls, seconds) in self.timers.items():
+                metrics[name + 'Calls'] = calls
+                metrics[name + 'Seconds'] = seconds
+        return metrics
@@ -1,25 +1,38 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat, zip_longest
+
 import matplotlib.pyplot as plt
 import numpy as np
 from classes.widgets import CutOffCursor
 from math import *
-from matplotlib.ticker import FormatStrFormatter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from matplotlib.ticker import FormatStrFormatter, FuncFormatter, MaxNLocator
+from matplotlib.transforms import Bbox
 
 
 class BaseFig(object):
 
 
-    def __init__(self, xaxis=None, yaxis=None):
-        "Init new figure"
-        self.figure = plt.figure()
+    def __init__(self, xaxis=None, yaxis=None, figure=None):
+        "Init new figure, drawing onto `figure` if set instead of a new pyplot figure"
+        self.figure = figure if figure is not None else plt.figure()
         self.closed = True
-        self.xaxis = list(xaxis) if xaxis else None
-        self.yaxis = list(yaxis) if yaxis else None
+        self.shown = False # figure may be drawn without being shown, e.g for export
+        self.xaxis = list(xaxis) if xaxis is not None else None
+        self.yaxis = list(yaxis) if yaxis is not None else None
         self.setup_axes()
 
     def show(self):
         "Show figure and set open/closed state"
         self.figure.show()
         self.closed = False
+        self.shown = True
 
     def close(self):
         "Close figure window"
@@ -52,19 +65,31 @@ class BaseFig(object):
 class BaseHist(BaseFig):
     """
     Base histogram class, providing interface to a matplotlib figure.
+    Bars of each subplot are drawn as a single collection, colored by a RGBA array.
     """
 
     cutoff = None # flag for open/closed state
+    BAR_WIDTH = 0.8
+    BAR_COLOR = 'C0'
+    FILTERED_COLOR = 'orange'
 
     def __init__(self, xaxis, yaxis):
         "Init new matplotlib figure, setup widget, events, and layout"
 
         # Tick every 10
         self.positionTicks=range(min(xaxis) - max(xaxis) % 5, max(xaxis)+10, 10)
-        self.filtered = dict()
-        self.bars = list()
+        self.bars = list() # bars collection of each subplot
+        self.barVerts = list() # (bar x 4 x 2) vertices of each subplot bars
+        self.barColors = list() # (bar x 4) RGBA colors of each subplot bars
+        self.barHeights = list()
         super().__init__(xaxis, yaxis)
 
+        # bar indices sorted by height, for each subplot
+        # bars from filterStart on are the ones above cut off
+        self.barOrder = [np.argsort(heights, kind='mergesort') for heights in self.barHeights]
+        self.sortedHeights = [heights[order] for heights, order in zip(self.barHeights, self.barOrder)]
+        self.filterStart = [len(heights) for heights in self.barHeights]
+
         self.xlabel = self.figure.axes[-1].set_xlabel('Residue')
         self.ylabel = self.figure.text(0.04, 0.5, 'Chem Shift Intensity',
                             va='center', rotation='vertical')
@@ -76,6 +101,8 @@ class BaseHist(BaseFig):
 
         # initial draw
         self.figure.canvas.draw()
+        if self.cutoff:
+            self.set_cutoff(self.cutoff)
 
     @property
     def cutoff_str(self):
@@ -84,6 +111,27 @@ class BaseHist(BaseFig):
         else:
             return "Cut-off : {cutoff}".format(cutoff=self.cutoff)
 
+    def add_bars(self, ax, heights):
+        """
+        Plots `heights` as bars centered on x axis positions, as a single collection in `ax`.
+        Bars are not antialiased, so that redrawing some of them over
+        the current rendering gives the same pixels as a full redraw.
+        """
+        positions = np.asarray(self.xaxis, dtype=float)
+        heights = np.asarray(heights, dtype=float)
+        left, right = positions - self.BAR_WIDTH / 2, positions + self.BAR_WIDTH / 2
+        verts = np.zeros((len(positions), 4, 2))
+        verts[..., 0] = np.column_stack((left, left, right, right))
+        verts[:, 1:3, 1] = heights[:, np.newaxis]
+        colors = np.tile(to_rgba(self.BAR_COLOR), (len(positions), 1))
+        bars = PolyCollection(verts, facecolors=colors, edgecolors='none', antialiaseds=False)
+        ax.add_collection(bars)
+        ax.autoscale_view()
+        self.bars.append(bars)
+        self.barVerts.append(verts)
+        self.barColors.append(colors)
+        self.barHeights.append(heights)
+
     def on_draw(self, event):
         "Prevent cut off hiding, e.g on window resize"
         self.cursor.visible = True
@@ -91,14 +139,14 @@ class BaseHist(BaseFig):
 
     def init_cursor(self):
         """
-        Init cursor widget and connect it to self.on_cutoff_update
+        Init cursor widget and connect it to self.on_cutoff_update.
+        Bars are recolored while dragging cursor, see draw().
         """
         self.cursor = CutOffCursor(self.figure.canvas, self.figure.axes,
                                     color='r', linestyle='--', lw=0.8,
                                     horizOn=True, vertOn=False )
         self.cursor.on_changed(self.on_cutoff_update)
-        if self.cutoff:
-            self.set_cutoff(self.cutoff)
+        self.cursor.on_dragged(self.draw)
 
     def add_cutoff_listener(self, func, mouseUpdateOnly=False):
         "Add extra on_change cutoff event handlers"
@@ -112,35 +160,88 @@ class BaseHist(BaseFig):
         Listener method to be connected to cursor widget
         """
         BaseHist.cutoff = cutoff
-        self.cutoffText.set_text(self.cutoff_str)
         self.draw()
 
     def set_cutoff(self, cutoff):
         """
         Cut off setter.
         Triggers change of cut off cursor value, allowing to update figure content.
-        kwargs are passed to cursor widget set_cutoff method.
+        Figures never shown are updated as well, so that exported figures show cut off.
         """
         BaseHist.cutoff = cutoff
         if not self.closed:
             self.cursor.set_cutoff(cutoff)
+        elif not self.shown: # figure is only drawn offscreen
+            self.cursor.cutoff = cutoff
+            self.on_cutoff_update(cutoff)
+            self.cursor.update_lines(None, cutoff)
 
-    def draw(self):
-        """
-        Updates bars color according to current cut off value.
-        """
-        for ax, axBar in zip(self.figure.axes, self.bars):
-            for bar in axBar:
-                if self.cutoff:
-                    if bar.get_height() >= self.cutoff: # show high intensity residues
-                        if not self.filtered.get(bar):
-                            bar.set_facecolor('orange')
-                            self.filtered[bar] = 1
-                    else:
-                        if self.filtered.get(bar):
-                            bar.set_facecolor(None)
-                            self.filtered[bar] = 0
-        self.figure.canvas.draw()
+    def draw(self, cutoff=None):
+        """
+        Updates bars color according to `cutoff` value, current cut off by default.
+        Only bars crossing cut off since last update are recolored,
+        found by binary search in bars sorted by height.
+        """
+        cutoff = self.cutoff if cutoff is None else cutoff
+        changed = []
+        if cutoff:
+            for index, (order, heights) in enumerate(zip(self.barOrder, self.sortedHeights)):
+                start = np.searchsorted(heights, cutoff, side='left')
+                previous = self.filterStart[index]
+                if start == previous:
+                    continue
+                # show high intensity residues
+                color = to_rgba(self.FILTERED_COLOR if start < previous else self.BAR_COLOR)
+                indices = order[min(start, previous):max(start, previous)]
+                self.barColors[index][indices] = color
+                self.bars[index].set_facecolor(self.barColors[index])
+                self.filterStart[index] = start
+                changed.append((index, indices, color))
+        self.refresh(changed)
+
+    def refresh(self, changed=()):
+        """
+        Renders updated bars and cut off text.
+        `changed` is a list of (subplot index, bar indices, color) tuples of recolored bars.
+        If canvas supports blitting, only those bars are drawn over cursor background,
+        and blitted along with cursor lines, see CutOffCursor.
+        Otherwise whole canvas is redrawn.
+        """
+        canvas = self.figure.canvas
+        if not self.cursor.useblit or getattr(self.cursor, 'background', None) is None:
+            self.cutoffText.set_text(self.cutoff_str)
+            canvas.draw()
+            return
+        canvas.restore_region(self.cursor.background)
+        for index, indices, color in changed:
+            self.draw_bars(index, indices, color)
+        textRegion = None
+        if self.cutoffText.get_text() != self.cutoff_str:
+            textRegion = self.draw_cutoff_text()
+        self.cursor.background = canvas.copy_from_bbox(self.figure.bbox)
+        if textRegion is not None:
+            canvas.blit(textRegion)
+
+    def draw_bars(self, index, indices, color):
+        "Draws bars `indices` of subplot `index` with `color`, over current rendering"
+        ax = self.bars[index].axes
+        bars = PolyCollection(self.barVerts[index][indices], facecolors=[color], edgecolors='none',
+                            antialiaseds=False, transform=ax.transData)
+        bars.set_figure(self.figure)
+        bars.set_clip_box(ax.bbox)
+        ax.draw_artist(bars)
+
+    def draw_cutoff_text(self):
+        "Draws current cut off text over previous one, returns the updated region"
+        previous = self.cutoffText.get_window_extent()
+        self.cutoffText.set_text(self.cutoff_str)
+        region = Bbox.union([previous, self.cutoffText.get_window_extent()])
+        region = Bbox.from_extents(floor(region.x0), floor(region.y0), ceil(region.x1), ceil(region.y1))
+        eraser = Rectangle(region.p0, region.width, region.height, facecolor=self.figure.get_facecolor(),
+                        edgecolor='none', antialiased=False)
+        self.figure.draw_artist(eraser)
+        self.figure.draw_artist(self.cutoffText)
+        return region
 
 
 class Hist(BaseHist):
@@ -165,8 +266,7 @@ class Hist(BaseHist):
         ax.set_xticks(self.positionTicks)
         maxVal = np.amax(self.yaxis)
         ax.set_ylim(0, np.round(maxVal + maxVal*0.1, decimals=1))
-        #self.background.append(self.figure.canvas.copy_from_bbox(ax.bbox))
-        self.bars.append(ax.bar(self.xaxis, self.yaxis, align='center', alpha=1))
+        self.add_bars(ax, self.yaxis)
 
 
 
@@ -190,27 +290,116 @@ class MultiHist(BaseHist):
         self.figure.subplots(nrows=len(self.yaxis), ncols=1,
                             sharex=True, sharey=True, squeeze=True)
         # Set content and layout for each subplot.
+        maxVal = np.amax(self.yaxis)
         for index, ax in enumerate(self.figure.axes):
             ax.set_xticks(self.positionTicks)
-            maxVal = np.amax(self.yaxis)
             ax.set_ylim(0, np.round(maxVal + maxVal*0.1, decimals=1))
             stepLabel = "{step}.".format(step=str(index+1))
             ax.set_ylabel(stepLabel, rotation="horizontal", labelpad=15)
             ax.yaxis.set_label_position('right')
             #ax.yaxis.label.set_color('red')
-            #self.background.append(self.figure.canvas.copy_from_bbox(ax.bbox))
-            self.bars.append(ax.bar(self.xaxis, self.yaxis[index], align='center', alpha=1))
+            self.add_bars(ax, self.yaxis[index])
         #self.figure.subplots_adjust(left=0.15)
 
 
+class Heatmap(BaseFig):
+    """
+    Chem shift intensities of residues at all titration steps, drawn as a single image
+    with a column per residue, ordered by position, and steps along y axis.
+    Intensities above cut off are outlined by a contour line.
+    Figure holds the same artists whatever the number of residues and steps.
+    """
+
+    COLORMAP = 'viridis'
+    CONTOUR_COLOR = 'r'
+    cutoff_str = BaseHist.cutoff_str
+
+    def __init__(self, positions, intensities, cutoff=None):
+        """
+        `intensities` is a (step x residue) array, with a column for each residue in `positions`.
+        Its first line is plotted as step 1.
+        """
+        if not len(positions) or not len(intensities):
+            raise ValueError("No intensities to plot as heatmap.")
+        self.positions = np.asarray(positions, dtype=int)
+        order = np.argsort(self.positions, kind='mergesort')
+        self.positions = self.positions[order]
+        self.intensities = np.asarray(intensities, dtype=float)[:, order]
+        self.cutoff = cutoff
+        self.contour = None
+        super().__init__()
+        self.figure.suptitle('Titration : steps 1 to {last}'.format(last=len(self.intensities)))
+        self.cutoffText = self.figure.text(0.13, 0.9, self.cutoff_str)
+        self.init_events()
+        self.draw_contour()
+
+    def setup_axes(self):
+        """
+        Creates image of intensities, with a column per residue labelled by its position,
+        so that image size does not depend on gaps in residue numbering.
+        """
+        ax = self.figure.subplots(nrows=1, ncols=1, squeeze=True)
+        self.columns = np.arange(len(self.positions))
+        self.steps = np.arange(1, len(self.intensities) + 1)
+        self.grid = np.ma.masked_invalid(self.intensities)
+        self.image = ax.imshow(self.grid, cmap=self.COLORMAP, aspect='auto', origin='lower',
+                            interpolation='nearest',
+                            extent=(self.columns[0] - 0.5, self.columns[-1] + 0.5,
+                                    self.steps[0] - 0.5, self.steps[-1] + 0.5))
+        ax.set_xlabel('Residue')
+        ax.set_ylabel('Titration step')
+        ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+        ax.xaxis.set_major_formatter(FuncFormatter(self.position_label))
+        ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+        self.figure.colorbar(mappable=self.image, ax=ax).set_label('Chem Shift Intensity')
+
+    def position_label(self, column, tickPosition=None):
+        "Tick label of image column `column`, i.e position of its residue"
+        column = int(round(column))
+        return str(self.positions[column]) if 0 <= column < len(self.positions) else ''
+
+    def draw_contour(self):
+        """
+        Outlines intensities above cut off, replacing previous contour.
+        No contour is drawn for cut off out of intensities range, or for a single step or residue.
+        """
+        if self.contour is not None:
+            for collection in self.contour.collections:
+                collection.remove()
+            self.contour = None
+        if self.cutoff is None or min(self.grid.shape) < 2 or self.grid.count() == 0:
+            return
+        if self.grid.min() < self.cutoff < self.grid.max():
+            self.contour = self.image.axes.contour(self.columns, self.steps, self.grid, levels=[self.cutoff],
+                                                colors=self.CONTOUR_COLOR, linewidths=0.8)
+
+    def set_cutoff(self, cutoff):
+        "Sets cut off, updating its contour and text"
+        self.cutoff = cutoff
+        self.cutoffText.set_text(self.cutoff_str)
+        self.draw_contour()
+        self.figure.canvas.draw_idle()
+
+
 class ShiftMap(BaseFig):
+    """
+    Chem shifts 2D map of residues, colored by titration step.
+    Chem shifts of all residues are drawn by a single scatter plot,
+    and each residue trajectory over titration steps by a single line collection.
+    """
 
-    def __init__(self, residues):
+    RASTERIZE_ABOVE = 1000 # residues count above which maps are rasterized by default
 
+    def __init__(self, residues, rasterized=None):
+        """
+        If `rasterized` is set, chem shifts are rasterized when figure is exported to vector formats,
+        e.g PDF, keeping exported files small. Defaults to rasterizing maps of many residues.
+        """
         if not residues:
             raise ValueError("No residues to plot as shiftmap.")
             return
         self.residues = list(residues)
+        self.rasterized = len(self.residues) > self.RASTERIZE_ABOVE if rasterized is None else rasterized
         self.colormap = plt.cm.get_cmap('hsv', len(self.residues[0].chemshiftH))
         super().__init__()
         self.figure.suptitle('Chemical shifts 2D map')
@@ -218,12 +407,15 @@ class ShiftMap(BaseFig):
         self.figure.text(0.04, 0.5, 'N Chemical Shift', va='center', rotation='vertical')
 
     def setup_axes(self):
-        for res in self.residues :
-            xaxis = res.chemshiftH
-            yaxis = res.chemshiftN
-            im=plt.scatter(xaxis, yaxis,
+        ax = self.figure.add_subplot(1, 1, 1)
+        trajectories = chemshift_trajectories(self.residues)
+        chemshifts = np.concatenate(trajectories)
+        steps = np.concatenate([np.arange(len(trajectory)) for trajectory in trajectories])
+        ax.add_collection(LineCollection(trajectories, colors='grey', linewidths=0.5, alpha=0.3,
+                                        rasterized=self.rasterized))
+        im = ax.scatter(chemshifts[:, 0], chemshifts[:, 1],
                         facecolors='none', cmap=self.colormap,
-                        c = range(len(xaxis)), alpha=0.2)
+                        c=steps, alpha=0.2, rasterized=self.rasterized)
 
         self.figure.subplots_adjust(left=0.15, top=0.90,
                             right=0.85, bottom=0.15) # make room for legend
@@ -232,112 +424,219 @@ class ShiftMap(BaseFig):
         self.figure.colorbar(mappable=im, cax=cbar_ax).set_label("Titration steps")
 
 
-class SplitShiftMap(ShiftMap):
+class SplitLayout(object):
+    """
+    Class SplitLayout.
+    Geometry of a split shift map, computed at once for all selected residues :
+    subplot limits, sharing the same H and N ranges, chem shift vectors and residue labels placement.
+    Selection is split in pages of `pageSize` residues, drawn on a grid of the same size.
+    Holds plain arrays only, so that pages may be drawn in other processes, see export_split_shiftmap().
+    """
+
+    PAGE_SIZE = 36 # residues per page
 
-    MAXSUBPLOTS = 36
+    def __init__(self, residues, pageSize=None):
+        residues = list(residues)
+        if not residues:
+            raise ValueError("No residues to plot as shiftmap.")
+        self.pageSize = pageSize or self.PAGE_SIZE
+        trajectories = chemshift_trajectories(residues)
+        lengths = np.array([len(trajectory) for trajectory in trajectories])
+        if not lengths.all(): # residues without any chem shift have nothing to draw
+            residues = [res for res, length in zip(residues, lengths) if length]
+            trajectories = [trajectory for trajectory in trajectories if len(trajectory)]
+            lengths = lengths[lengths > 0]
+            if not residues:
+                raise ValueError("No chem shifts to plot as shiftmap.")
+        self.positions = [res.position for res in residues]
+        self.steps = len(residues[0].chemshiftH) # colormap size
+        chemshifts = np.full((len(residues), lengths.max(), 2), np.nan)
+        for row, trajectory in enumerate(trajectories):
+            chemshifts[row, :len(trajectory)] = trajectory
+        self.trajectories = list(trajectories)
+
+        # subplots are centered on residue chem shifts, and span 1.5 times the largest ranges of selection
+        low, high = np.nanmin(chemshifts, axis=1), np.nanmax(chemshifts, axis=1)
+        self.span = np.max(high - low, axis=0) * 1.5
+        center = (low + high) / 2
+        self.limits = np.stack((center - self.span / 2, center + self.span / 2), axis=-1) # (residue x nucleus x 2)
+
+        # chem shift vectors, from first to last step
+        self.origins = chemshifts[:, 0]
+        self.shifts = chemshifts[np.arange(len(residues)), lengths - 1] - self.origins
+        # labels are offset orthogonally to chem shift vectors, scaled to subplot ratio
+        norms = np.sum(self.shifts ** 2, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offsets = 1.0 - np.where(norms > 0, self.shifts.sum(axis=1) / norms, 0)[:, np.newaxis] * self.shifts
+        # vectors along diagonal
+        diagonal = ~np.any(offsets, axis=1)
+        offsets[diagonal] = self.shifts[diagonal, ::-1] * [-1.0, 1.0]
+        offsets *= np.array([self.span[0] / self.span[1], 1.0])
+        self.offsets = offsets / (np.linalg.norm(offsets, axis=1) * 10)[:, np.newaxis]
+        self.spacing = None # (wspace, hspace) of subplots, see SplitShiftMap
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def pages(self):
+        "Number of pages"
+        return ceil(len(self) / self.pageSize)
+
+    @property
+    def grid(self):
+        "(rows, columns) of subplots grid, the same for all pages"
+        count = min(len(self), self.pageSize)
+        return ceil(sqrt(count)), round(sqrt(count))
+
+    def page_rows(self, page):
+        "Residue indices on page `page`"
+        return range(page * self.pageSize, min((page + 1) * self.pageSize, len(self)))
+
+
+class SplitShiftMap(BaseFig):
+    """
+    Chem shifts 2D map of residues, each residue in its own subplot.
+    Selections larger than a page are paginated, see SplitLayout, showing page `page` only.
+    """
 
-    def __init__(self, residues):
-        self.resCount = len(residues)
-        if self.resCount > self.MAXSUBPLOTS:
-            raise ValueError("Refusing to plot too many ({count}) residues in split mode. Sorry.".format(
-                                count=self.resCount))
-        elif self.resCount == 1:
+    def __init__(self, residues, page=0, rasterized=None, figure=None):
+        "`residues` is an iterable of residues, or a SplitLayout computed beforehand"
+        self.layout = residues if isinstance(residues, SplitLayout) else SplitLayout(residues)
+        if len(self.layout) == 1:
             raise ValueError("Refusing to plot in split mode for only one residue. Please use ShiftMap class instead.")
-        super().__init__(residues)
+        if not 0 <= page < self.layout.pages:
+            raise ValueError("Invalid page {page}, split shift map has {pages} pages.".format(
+                                page=page + 1, pages=self.layout.pages))
+        self.page = page
+        self.rasterized = bool(rasterized)
+        self.colormap = plt.cm.get_cmap('hsv', self.layout.steps)
+        super().__init__(figure=figure)
+        title = 'Chemical shifts 2D map'
+        if self.layout.pages > 1:
+            title += ' (page {page}/{pages})'.format(page=page + 1, pages=self.layout.pages)
+        self.figure.suptitle(title)
+        self.figure.text(0.5, 0.04, 'H Chemical Shift', ha='center')
+        self.figure.text(0.04, 0.5, 'N Chemical Shift', va='center', rotation='vertical')
 
     def setup_axes(self):
-        self.axes = self.figure.subplots(nrows=ceil(sqrt(self.resCount)),
-                                    ncols=round(sqrt(self.resCount)),
-                                    sharex=False, sharey=False, squeeze=True)
+        nrows, ncols = self.layout.grid
+        self.axes = self.figure.subplots(nrows=nrows, ncols=ncols,
+                                    sharex=False, sharey=False, squeeze=False)
         # iterate over each created cell
-        for index, ax in enumerate(self.axes.flat):
-            if index < self.resCount:
-                res = self.residues[index]
-                xaxis = res.chemshiftH
-                yaxis = res.chemshiftN
-                # Trace chem shifts for current residu in new graph cell
-                im = ax.scatter(xaxis, yaxis,
-                                facecolors='none', cmap=self.colormap,
-                                c = range(len(xaxis)), alpha=0.2)
-                # ax.set_title("Residue %s " % res.position, fontsize=10)
-                # print xticks as 2 post-comma digits float
-                ax.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
-                ax.tick_params(labelsize=8)
-            else:
+        for ax, row in zip_longest(self.axes.flat, self.layout.page_rows(self.page)):
+            if row is None:
                 ax.remove() # remove extra subplots
-
-        # scale
-        self.scale()
-        # annotate
-        for index, ax in enumerate(self.axes.flat):
-            if index < self.resCount:
-                self.annotate_chemshift(self.residues[index], ax)
-
-        # display them nicely
-        self.figure.tight_layout()
+                continue
+            trajectory = self.layout.trajectories[row]
+            # Trace chem shifts for current residu in new graph cell
+            im = ax.scatter(trajectory[:, 0], trajectory[:, 1],
+                            facecolors='none', cmap=self.colormap,
+                            c = range(len(trajectory)), alpha=0.2, rasterized=self.rasterized)
+            # print xticks as 2 post-comma digits float
+            ax.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+            ax.tick_params(labelsize=8)
+            ax.set_xlim(*self.layout.limits[row, 0])
+            ax.set_ylim(*self.layout.limits[row, 1])
+            self.annotate_chemshift(row, ax)
+
+        # display them nicely, pages of a selection share the spacing of its first drawn page
+        if self.layout.spacing is None:
+            self.figure.tight_layout()
+            self.layout.spacing = (self.figure.subplotpars.wspace, self.figure.subplotpars.hspace)
+        else:
+            self.figure.subplots_adjust(wspace=self.layout.spacing[0], hspace=self.layout.spacing[1])
         # Add colorbar legend for titration steps using last plot cell data
         self.figure.subplots_adjust(left=0.12, top=0.9,
                             right=0.85,bottom=0.15) # make room for legend
         cbar_ax = self.figure.add_axes([0.90, 0.15, 0.02, 0.75])
         self.figure.colorbar(mappable=im, cax=cbar_ax).set_label("Titration steps")
 
-    def scale(self):
-        "Scales subplots when plotting splitted shift map"
-        xMaxRange, yMaxRange = np.array(self.get_max_range_NH()) * 1.5
-        for ax in self.axes.flat:
-            currentXRange = ax.get_xlim()
-            currentYRange = ax.get_ylim()
-            xMiddle = sum(currentXRange) / 2
-            yMiddle = sum(currentYRange) / 2
-            ax.set_xlim(xMiddle - xMaxRange/2, xMiddle + xMaxRange/2)
-            ax.set_ylim(yMiddle - yMaxRange/2, yMiddle + yMaxRange/2)
-
-    def get_max_range_NH(self):
-        "Returns max range tuple for N and H among residues in residueSet"
-        return (max([res.rangeH for res in self.residues]),
-                max([res.rangeN for res in self.residues]))
-
-    def annotate_chemshift(self, residue, ax):
-        "Adds chem shift vector and residue position for current residue in current subplot"
-        xlim, ylim = ax.get_xlim(), ax.get_ylim()
-        xrange, yrange = (xlim[1] - xlim[0], ylim[1] - ylim[0])
-
-        shiftVector = np.array(residue.arrow[2:])
-        orthoVector = np.array([1.0,1.0])
-        # make orthogonal
-        orthoVector -= orthoVector.dot(shiftVector) * shiftVector / np.linalg.norm(shiftVector)**2
-        # scale ratio
-        orthoVector *= np.array([xrange/yrange, 1.0])
-        # normalize
-        orthoVector /= (np.linalg.norm(orthoVector) * 10)
-
-        """
-        # plot using mpl arrow
-        ax.arrow(*np.array(residue.arrow[:2]) + x, *residue.arrow[2:],
-                head_width=0.07, head_length=0.1, fc='red', ec='red', lw=0.5,
-                length_includes_head=True, linestyle='-', alpha=0.7, overhang=0.7)
-        """
-        arrowStart = np.array(residue.arrow[:2]) + orthoVector
-        ax.annotate("", xy=arrowStart + shiftVector, xytext=arrowStart,
+    def annotate_chemshift(self, row, ax):
+        "Adds chem shift vector and position of residue `row` of layout in subplot `ax`"
+        origin, shift, offset = self.layout.origins[row], self.layout.shifts[row], self.layout.offsets[row]
+        arrowStart = origin + offset
+        ax.annotate("", xy=arrowStart + shift, xytext=arrowStart,
                     arrowprops=dict(arrowstyle="->", fc="red", ec='red', lw=0.5))
-        """
-        # show orthogonal vector
-        ax.arrow(*residue.arrow[:2], *x, head_width=0.02, head_length=0.02, fc='black', ec='green',
-                length_includes_head=True, linestyle=':', alpha=0.6, overhang=0.5)
-        """
-        horAlign = "left" if orthoVector[0] <=0 else "right"
-        vertAlign = "top" if orthoVector[1] >=0 else "bottom"
-        ax.annotate(str(residue.position), xy=residue.chemshift[0],
-                    xytext=residue.chemshift[0]-0.8*orthoVector,
+        horAlign = "left" if offset[0] <=0 else "right"
+        vertAlign = "top" if offset[1] >=0 else "bottom"
+        ax.annotate(str(self.layout.positions[row]), xy=origin,
+                    xytext=origin - 0.8 * offset,
                     xycoords='data', textcoords='data',
                     fontsize=7, ha=horAlign, va=vertAlign)
 
+
+def chemshift_trajectories(residues):
+    """
+    (H, N) chem shifts of each residue over titration steps, missing steps excluded.
+    Chem shifts are gathered at once from store when residues share it and have no missing data.
+    """
+    store = residues[0].store
+    if all(res.store is store and res.row is not None for res in residues):
+        rows = np.fromiter((res.row for res in residues), dtype=int, count=len(residues))
+        if not store.missing[rows].any():
+            # nucleus axis is ordered (H, N)
+            return store.chemshifts[rows]
+    return [np.column_stack((res.chemshiftH, res.chemshiftN)) for res in residues]
+
+def draw_split_page(layout, page, rasterized=None):
+    "Draws page `page` of split shift map `layout` on a new figure, outside of pyplot"
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    SplitShiftMap(layout, page=page, rasterized=rasterized, figure=figure)
+    return figure
+
+def render_split_page(layout, page, path, rasterized=None):
+    "Writes page `page` of split shift map `layout` to `path`, returns path"
+    figure = draw_split_page(layout, page, rasterized)
+    figure.savefig(path, dpi=figure.dpi)
+    return path
+
+def export_split_shiftmap(residues, path, rasterized=None, workers=None):
+    """
+    Writes all pages of split shift map of `residues`, or of their SplitLayout, to `path`.
+    A PDF path gets a single multi-page vector document, drawn in current process.
+    Other formats get one file per page, numbered after `path` if there are several pages,
+    drawn in parallel processes if `workers` > 1. Returns list of written files.
+    """
+    layout = residues if isinstance(residues, SplitLayout) else SplitLayout(residues)
+    pages = range(layout.pages)
+    root, extension = os.path.splitext(path)
+    if extension.lower() == '.pdf':
+        with PdfPages(path) as pdf:
+            for page in pages:
+                pdf.savefig(draw_split_page(layout, page, rasterized))
+        return [path]
+    if layout.pages == 1:
+        paths = [path]
+    else:
+        paths = ["{root}_{page:03d}{extension}".format(root=root, page=page + 1, extension=extension)
+                for page in pages]
+
+    # first page sets subplots spacing of next ones
+    results = [render_split_page(layout, 0, paths[0], rasterized)]
+    workers = min(workers or os.cpu_count() or 1, layout.pages - 1)
+    arguments = (repeat(layout), pages[1:], paths[1:], repeat(rasterized))
+    if workers > 1 and layout.pages > 2:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results.extend(executor.map(render_split_page, *arguments))
+    else:
+        results.extend(map(render_split_page, *arguments))
+    return results
+
+
 class TitrationCurve(BaseFig):
 
-    def __init__(self, titrationSteps, residue, titrant='titrant', analyte='analyte'):
+    def __init__(self, titrationSteps, residue, titrant='titrant', analyte='analyte', fit=None, band=None):
+        """
+        `fit` is an optional (xaxis, yaxis, Kd) tuple, plotted as fitted binding curve.
+        `band` is an optional (xaxis, low, high) tuple, plotted as fitted curve error band.
+        """
         self.residue = residue
         self.titrant = titrant
         self.analyte = analyte
+        self.fit = fit
+        self.band = band
         xaxis = titrationSteps
         yaxis = list(residue.chemshiftIntensity)
         super().__init__(xaxis, yaxis)
@@ -348,20 +647,18 @@ class TitrationCurve(BaseFig):
 
     def setup_axes(self):
         im = plt.scatter(self.xaxis, self.yaxis, alpha=1)
+        if self.fit is not None:
+            xFit, yFit, kd = self.fit
+            plt.plot(xFit, yFit, color='orange', label="Kd = {kd:.3g} µM".format(kd=kd))
+            if self.band is not None:
+                plt.fill_between(*self.band, color='orange', alpha=0.25, linewidth=0, label="Confidence band")
+            plt.legend(loc='lower right')
         plt.xlabel("[{titrant}]/[{analyte}]".format(
             titrant=self.titrant, analyte=self.analyte))
 
         self.figure.text(0.04, 0.5, 'Chem Shift Intensity',
                 va='center', rotation='vertical', fontsize=11)
         """
-        z = np.polyfit(xAxis, yAxis, 4)
-        f = np.poly1d(z)
-
-        xnew = np.linspace(0,max(xAxis),100)
-        ynew = f(xnew)
-        plt.plot(xnew, ynew)
-        """
-        """
         fig.subplots_adjust(left=0.12, top=0.90,
                             right=0.85,bottom=0.14) # make room for legend
         # Add colorbar legend for titration steps
@@ -0,0 +1,113 @@
+""" Profiler module
+
+Profiling of shell commands and titration loading, for finding where time and memory go.
+Each profiled block gets cProfile statistics, wall clock time, and peak memory allocated
+while it runs, as traced by tracemalloc.
+Note that tracing memory allocations slows profiled code down.
+"""
+
+import cProfile
+import os
+import pstats
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """
+    Class Profiler.
+    Profiles labelled blocks of code, see measure(), printing a report of top functions
+    sorted by cumulative time after each block.
+    If `directory` is set, each block statistics are written there as a `.pstats` file.
+    Statistics of all blocks are accumulated, and may be written at once by dump().
+    """
+
+    SORT = 'cumulative'
+    TOP = 15 # functions shown in reports
+
+    def __init__(self, enabled=False, directory=None, top=None, stream=None):
+        self.enabled = enabled
+        self.directory = directory
+        self.top = top or self.TOP
+        self.stream = stream # reports stream, defaults to current sys.stderr
+        self.stats = None # accumulated pstats.Stats
+        self.count = 0 # profiled blocks
+
+    def enable(self, directory=None, top=None):
+        "Starts profiling blocks, writing their statistics in `directory` if set"
+        self.enabled = True
+        self.directory = directory
+        self.top = top or self.top
+
+    def disable(self):
+        "Stops profiling blocks, accumulated statistics are kept"
+        self.enabled = False
+
+    @contextmanager
+    def measure(self, label):
+        "Context manager profiling enclosed block as `label`, if profiling is enabled"
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        startMemory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - startMemory
+            if not tracing:
+                tracemalloc.stop()
+            self.record(label, profile, wall, peak)
+
+    def record(self, label, profile, wall, peak):
+        "Reports and stores statistics of `profile`, which profiled block `label`"
+        self.count += 1
+        stream = self.stream or sys.stderr
+        print("[Profile]\t{label} : {wall:.3f} s, {peak:.2f} MiB peak memory".format(
+            label=label, wall=wall, peak=peak / 2**20), file=stream)
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(self.SORT).print_stats(self.top)
+
+        if self.directory:
+            name = re.sub(r'\W+', '_', label.split()[0] if label.split() else 'block')
+            path = os.path.join(self.directory, "{count:03d}_{name}.pstats".format(count=self.count, name=name))
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                stats.dump_stats(path)
+            except OSError as error:
+                print("Could not write profile to {path} : {error}".format(path=path, error=error), file=stream)
+
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def dump(self, path):
+        """
+        Writes statistics accumulated over all profiled blocks to `path`, as a `.pstats` file.
+        Raises ValueError if no block was profiled.
+        """
+        if self.stats is None:
+            raise ValueError("Nothing was profiled yet, see `profile on`.")
+        self.stats.dump_stats(path)
+        return path
+
+    @property
+    def status(self):
+        "Returns profiling status as string"
+        return "Profiling is {state}{directory}, {count} blocks profiled".format(
+            state="on" if self.enabled else "off",
+            directory=" (writing to {dir})".format(dir=self.directory) if self.enabled and self.directory else "",
+            count=self.count)
@@ -0,0 +1,95 @@
+""" Step watcher module
+
+Background polling of a titration source directory, detecting new titration step files
+as soon as they are completely written.
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+class StepWatcher(threading.Thread):
+    """
+    Class StepWatcher.
+    Polls titration source directory every `interval` seconds, looking for `.list` files not loaded yet.
+    A file is considered completely written once its size and modification time
+    did not change for `settle` seconds.
+    Complete files are passed to `callback` in step order, as soon as they are the next expected steps.
+    Files rejected by titration are not passed again until they are modified.
+    Loaded files are watched too, with a warning if they are modified afterwards,
+    as changes to loaded steps are not taken into account.
+    """
+
+    def __init__(self, titration, callback, interval=1.0, settle=2.0):
+        super().__init__(daemon=True)
+        self.titration = titration
+        self.callback = callback
+        self.interval = interval
+        self.settle = settle
+        self.pending = dict() # {path: ((size, mtime), time since which file is unchanged)}
+        self.rejected = dict() # {path: (size, mtime)}
+        self.loaded = dict() # {path: (size, mtime)} of loaded files
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                ready = self.poll()
+            except OSError as error:
+                print("Could not watch {dir} : {error}".format(
+                    dir=self.titration.dirPath, error=error), file=sys.stderr)
+                continue
+            if ready:
+                try:
+                    self.callback(ready)
+                except (ValueError, IOError) as error:
+                    print("{error}".format(error=error), file=sys.stderr)
+                # remember file titration refused, until it changes
+                # following files were refused only because a step is missing
+                known = set(map(os.path.abspath, self.titration.files))
+                for path in ready:
+                    if path in known:
+                        self.loaded[path] = self.pending[path][0]
+                    else:
+                        self.rejected[path] = self.pending[path][0]
+                        break
+
+    def stop(self):
+        "Stops polling, current poll is completed if any"
+        self.stopEvent.set()
+
+    def poll(self):
+        "Returns paths of completely written files for next titration steps, in step order"
+        known = set(map(os.path.abspath, self.titration.files))
+        now = time.time()
+        pending = dict()
+        for entry in os.scandir(self.titration.dirPath):
+            path = os.path.abspath(entry.path)
+            if not entry.is_file() or not self.titration.PATH_PATTERN.match(path):
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if path in known:
+                if self.loaded.setdefault(path, signature) != signature:
+                    print("{file} was modified after being loaded, changes are ignored until titration is loaded again.".format(
+                        file=path), file=sys.stderr)
+                    self.loaded[path] = signature
+                continue
+            if self.rejected.get(path) == signature:
+                continue
+            previous = self.pending.get(path)
+            pending[path] = (signature, previous[1] if previous and previous[0] == signature else now)
+        self.pending = pending
+
+        # keep complete files following last loaded step
+        steps = dict([(self.titration.validate_filepath(path), path)
+                    for path, (signature, since) in pending.items()
+                    if signature[0] and now - since >= self.settle])
+        ready = []
+        step = self.titration.dataSteps
+        while step in steps:
+            ready.append(steps[step])
+            step += 1
+        return ready
@@ -116,7 +116,9 @@ class MultiDraggableCursor(MultiCursor):
             if self.horizOn:
                 for ax, line in zip(self.axes, self.hlines):
                     ax.draw_artist(line)
-            self.canvas.blit(self.canvas.figure.bbox)
+            # only axes content changes
+            for ax in self.axes:
+                self.canvas.blit(ax.bbox)
         else:
             self.canvas.draw_idle()
 
@@ -131,6 +133,7 @@ class WatchableWidgetMixin(object):
         self.observers = {}
         self.mouse_updated = False
         self.mouse_observers = dict()
+        self.drag_observers = dict()
 
     def on_changed(self, func):
         """
@@ -168,6 +171,20 @@ class WatchableWidgetMixin(object):
         self.cnt += 1
         return cid
 
+    def on_dragged(self, func):
+        """
+        While the widget is dragged with mouse, call *func* with its current value.
+        Dragged values are not committed, see on_changed.
+        Returns
+        -------
+        cid : int
+            Connection id (which can be used to disconnect *func*)
+        """
+        cid = self.cnt
+        self.drag_observers[cid] = func
+        self.cnt += 1
+        return cid
+
     def disconnect(self, cid):
         """
         Remove the observer with connection id *cid*
@@ -176,6 +193,7 @@ class WatchableWidgetMixin(object):
         cid : int
             Connection id of the observer to be removed
         """
+        self.drag_observers.pop(cid, None)
         try:
             del self.observers[cid]
             del self.mouse_observers[cid]
@@ -207,6 +225,13 @@ class CutOffCursor(MultiDraggableCursor, WatchableWidgetMixin):
         super().__init__(canvas, axes, useblit, horizOn, vertOn, **lineprops)
         WatchableWidgetMixin.__init__(self)
 
+    def on_move(self, event):
+        "While dragging cursor, signal its value to drag observers before moving cursor line"
+        if self.event_accept(event) and self.press and self.visible:
+            for cid, func in six.iteritems(self.drag_observers):
+                func(event.ydata)
+        super().on_move(event)
+
     def set_cutoff(self, cutoff, **kwargs):
         """
         Sets cutoff value, updating cutoff line.
@@ -4,7 +4,8 @@
 Shift2Me : 2D-NMR chemical shifts analysis for protein interactions.
 
 Usage:
-    shift2me.py [-c <cutoff>] [-i <titration.yml>] [-t <file.yml>] ( <dir> | <saved_job> )
+    shift2me.py [-c <cutoff>] [-i <titration.yml>] [-t <file.yml>] [-w] [-p [--profile-dir=<dir>]] ( <dir> | <archive> | <saved_job> )
+    shift2me.py batch [-c <cutoff>] [-i <titration.yml>] [-o <output>] [-j <jobs>] [--no-fit] [--no-plots] <source>...
     shift2me.py -h
 
 Options:
@@ -12,6 +13,14 @@ Options:
   -i <titration.yml>, --init-file=<titration.yml>     Initialize titration from file.yml (YML format)
   -t <file.yml>, --template=<file.yml>                Initialize a template titration.yml file,
                                                         to be filled with titration parameters.
+  -w, --watch                                           Watch <dir> for new titration steps, loading them as they are written.
+  -p, --profile                                         Profile titration loading and each shell command,
+                                                        printing time, peak memory and top functions.
+  --profile-dir=<dir>                                   Write profiles as `.pstats` files in <dir>.
+  -o <output>, --output=<output>                        Batch output directory [default: shift2me-batch]
+  -j <jobs>, --jobs=<jobs>                              Titrations processed in parallel, one per CPU by default.
+  --no-fit                                              Do not fit binding curves of filtered residues in batch.
+  --no-plots                                            Do not write figures in batch.
   -h --help                                             Print help and usage
 
 ShiftoMe enables you to determine which residues are significantly implicated in a protein-protein interaction.
@@ -20,27 +29,53 @@ interaction in a NMR titration experiment.
 It helps you to identify relevant residues to study thanks to splittable 2D shiftmaps and interactive step-by-step 
 intensity per residue histograms.
 
+<dir> may hold gzip compressed `.list.gz` files. <archive> is a tar or zip archive, or a directory within one,
+which titration files are read without extracting them.
+
+`batch` processes titrations without interactive shell : each <source> directory, archive or job file
+gets its own directory in <output>, holding intensities, filtered residues and fitted parameters
+as CSV files, along with histogram, shift map and titration curves PNG figures.
+
 Example :  ./shift2me.py data/listes/listPP
+           ./shift2me.py data/listes.tar.gz/listes/listPP
+           ./shift2me.py batch -c 0.1 -i titration.yml -o results/ screening/*/
 
 Authors : Hermes PARAQINDES, Louis Duchemin, Marc-Antoine GUERY and Rainier-Numa GEORGES
 """
 
+import os
 from docopt import docopt
-from matplotlib import pyplot as plt
+from classes import archives
 from classes.Titration import BaseTitration, TitrationCLI
-from classes.command import ShiftShell
+from classes.profiler import Profiler
 
 
 if __name__ == '__main__':
     ARGS = docopt(__doc__)
 
+    if ARGS["batch"]:
+        from classes.batch import run_batch
+        SUMMARIES = run_batch(ARGS["<source>"], ARGS["--output"],
+                            cutoff=ARGS["--cut-off"],
+                            initFile=ARGS["--init-file"],
+                            fit=not ARGS["--no-fit"],
+                            plots=not ARGS["--no-plots"],
+                            workers=int(ARGS["--jobs"]) if ARGS["--jobs"] else None)
+        exit(1 if any(summary["error"] for summary in SUMMARIES) else 0)
+
+    SOURCE = ARGS["<dir>"] or ARGS["<archive>"] or ARGS["<saved_job>"]
+    IS_JOB = os.path.isfile(SOURCE) and not archives.is_archive(SOURCE)
     TITRATION_KWARGS = {
-        "working_directory":ARGS["<dir>"],
-        "cutoff": ARGS["--cut-off"] or 0.1,
+        "working_directory": None if IS_JOB else SOURCE,
+        "jobFile": SOURCE if IS_JOB else None,
+        # saved jobs keep their own cutoff
+        "cutoff": ARGS["--cut-off"] or (None if IS_JOB else 0.1),
         "initFile": ARGS['--init-file']
     }
 
-    titration = TitrationCLI(**TITRATION_KWARGS)
+    PROFILER = Profiler(enabled=ARGS["--profile"], directory=ARGS["--profile-dir"])
+    with PROFILER.measure("load {source}".format(source=SOURCE)):
+        titration = TitrationCLI(**TITRATION_KWARGS)
 
     # Build titration instance
     if ARGS["--template"]:
@@ -49,9 +84,14 @@ if __name__ == '__main__':
         templateBuilder.dump_init_file(initFile = template)
         print("Generated template file at {file}".format(file=template))
         exit(0)
+    # shell and plotting modules are slow to import, and only needed from here
+    import matplotlib
+    from classes.command import ShiftShell
     # Turn off MPL interactive mode
-    plt.ioff()
+    matplotlib.interactive(False)
+    if ARGS["--watch"]:
+        titration.watch()
     # Init CLI
-    CLI = ShiftShell(titration = titration)
+    CLI = ShiftShell(titration = titration, profiler = PROFILER)
     # Start main loop
     CLI.cmdloop()